@@ -0,0 +1,97 @@
+"""
+Fake Telegram client and events for driving TelegramBot handlers without a
+network connection. Events are routed through the same event builders
+(patterns and filter functions) that the bot registers with Telethon.
+"""
+import asyncio
+import inspect
+import random
+import time
+from telethon import events
+from telethon.errors import FloodWaitError
+
+class FakeEvent:
+    """Stands in for a Telethon NewMessage or CallbackQuery event in a private chat."""
+    def __init__(self, client: 'FakeTelegramClient', user_id: int, text: str | None = None,
+                 data: bytes | None = None, is_private: bool = True):
+        self.client = client
+        self.sender_id = user_id
+        self.chat_id = user_id
+        self.text = text
+        self.raw_text = text
+        self.data = data
+        self.is_private = is_private
+        self.pattern_match = None
+
+    async def respond(self, message, buttons=None, **kwargs):
+        return await self.client.send_message(self.chat_id, message, buttons=buttons)
+
+    async def edit(self, message, buttons=None, **kwargs):
+        return await self.client.send_message(self.chat_id, message, buttons=buttons)
+
+    async def answer(self, message=None, alert=False, **kwargs):
+        return None
+
+
+class FakeTelegramClient:
+    """
+    Records handlers registered with add_event_handler and dispatches fake events to them.
+    Outgoing messages are collected per chat; `send_latency` simulates Telegram round trips,
+    and a `flood_rate` fraction of sends fail with a FloodWaitError of `flood_wait` seconds.
+    """
+    def __init__(self, send_latency: float = 0.0, flood_rate: float = 0.0, flood_wait: int = 1):
+        self.send_latency = send_latency
+        self.flood_rate = flood_rate
+        self.flood_wait = flood_wait
+        self.flood_waits = 0
+        self.handlers: list[tuple] = []
+        self.sent: dict[int, list[str]] = {}
+        self.messages_sent = 0
+        self.handler_calls = 0
+
+    def add_event_handler(self, callback, event=None):
+        self.handlers.append((callback, event))
+
+    async def send_message(self, chat_id, message, buttons=None, **kwargs):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        if self.flood_rate and random.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise FloodWaitError(request=None, capture=self.flood_wait)
+        self.messages_sent += 1
+        self.sent.setdefault(chat_id, []).append(message)
+        return message
+
+    async def _matches(self, builder, event) -> bool:
+        if isinstance(builder, events.NewMessage):
+            if event.data is not None:
+                return False
+            if builder.pattern:
+                match = builder.pattern(event.text or '')
+                if not match:
+                    return False
+                event.pattern_match = match
+        elif isinstance(builder, events.CallbackQuery):
+            if event.data is None:
+                return False
+        if builder.func:
+            result = builder.func(event)
+            if inspect.isawaitable(result):
+                result = await result
+            return bool(result)
+        return True
+
+    async def dispatch(self, event: FakeEvent) -> float:
+        """Runs every matching handler for the event, like Telethon does. Returns the time taken."""
+        started = time.perf_counter()
+        for callback, builder in self.handlers:
+            if await self._matches(builder, event):
+                self.handler_calls += 1
+                await callback(event)
+        return time.perf_counter() - started
+
+    async def message(self, user_id: int, text: str, is_private: bool = True) -> float:
+        return await self.dispatch(FakeEvent(self, user_id, text=text, is_private=is_private))
+
+    async def click(self, user_id: int, data: bytes) -> float:
+        return await self.dispatch(FakeEvent(self, user_id, data=data))
@@ -0,0 +1,146 @@
+"""
+Offline load test: runs thousands of simulated users through the full
+credit check conversation against a local Experian stand-in, then reports
+per-stage latency percentiles, throughput and peak RSS.
+
+Usage: python benchmarks/load_test.py [--users 2000] [--latency 0.2] [--throttle-rate 0.01] ...
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import config  # noqa: E402
+import experian_api  # noqa: E402
+from dispatcher import ExperianDispatcher  # noqa: E402
+from fake_telegram import FakeTelegramClient  # noqa: E402
+from mock_experian import MockExperianServer  # noqa: E402
+from result_cache import ResultCache  # noqa: E402
+from sender import TelegramSender  # noqa: E402
+from state_manager import StateManager  # noqa: E402
+from state_store import StateCipher, create_state_store  # noqa: E402
+from telegram_bot import TelegramBot  # noqa: E402
+
+class StageTimer:
+    """Collects latency samples per named stage."""
+    def __init__(self):
+        self.samples: dict[str, list[float]] = defaultdict(list)
+
+    def record(self, stage: str, seconds: float):
+        self.samples[stage].append(seconds)
+
+    def wrap(self, stage: str, func):
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+        return timed
+
+def percentile(ordered: list[float], pct: float) -> float:
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+def user_answers(user_id: int) -> list[str]:
+    """Valid, distinct answers for every text step, so results are not served from the cache."""
+    return [f"User{user_id}", f"Tester{user_id}", f"{user_id} Main St", "Springfield", "IL",
+            f"{10000 + user_id % 90000}", "1985-06-15"]
+
+async def run_user(client: FakeTelegramClient, timer: StageTimer, user_id: int, provide_ssn: bool):
+    started = time.perf_counter()
+    timer.record('command', await client.message(user_id, '/check_credit'))
+    for answer in user_answers(user_id):
+        timer.record('flow_step', await client.message(user_id, answer))
+    if provide_ssn:
+        timer.record('button', await client.click(user_id, b'consent_ssn_yes'))
+        timer.record('final_step', await client.message(user_id, f"{100 + user_id % 900:03d}-45-6789"))
+    else:
+        timer.record('final_step', await client.click(user_id, b'consent_ssn_no'))
+    timer.record('conversation', time.perf_counter() - started)
+
+async def run(args):
+    server = await MockExperianServer(latency=args.latency, error_rate=args.error_rate,
+                                      throttle_rate=args.throttle_rate, retry_after=args.retry_after).start()
+    config.set_settings(config.Settings(
+        telegram_api_id=None, telegram_api_hash=None, telegram_bot_token=None,
+        experian_api_base_url=server.base_url, experian_client_id='bench', experian_client_secret='bench',
+        experian_username='bench', experian_password='bench', loaded_at=time.monotonic()))
+    experian_api.create_http_client()
+
+    timer = StageTimer()
+    dispatcher = ExperianDispatcher(concurrency=args.experian_concurrency, queue_size=args.users,
+                                    rate_limit=args.rate_limit)
+    dispatcher.call = timer.wrap('experian_call', dispatcher.call)
+    experian_api.get_experian_access_token = timer.wrap('oauth_token', experian_api.get_experian_access_token)
+
+    client = FakeTelegramClient(send_latency=args.send_latency, flood_rate=args.flood_rate, flood_wait=args.flood_wait)
+    store = create_state_store(args.state_backend, sqlite_path=args.sqlite_path, encryption_key=StateCipher.generate_key())
+    sender = TelegramSender(global_rate=args.telegram_rate, chat_rate=args.chat_rate)
+    TelegramBot(client, StateManager(store), dispatcher, ResultCache(ttl=0), sender=sender)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    async def limited(user_id: int):
+        async with semaphore:
+            await run_user(client, timer, user_id, provide_ssn=user_id % 2 == 0)
+
+    # Group chatter from users who never start a conversation, to exercise the event filters
+    for user_id in range(args.users, args.users + args.noise):
+        timer.record('noise', await client.message(user_id, 'hello everyone', is_private=False))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(limited(user_id) for user_id in range(args.users)))
+    elapsed = time.perf_counter() - started
+    await sender.drain()
+    drained = time.perf_counter() - started
+
+    await dispatcher.stop()
+    await sender.close()
+    await store.close()
+    await experian_api.token_manager.close()
+    await experian_api.close_http_client()
+    await server.stop()
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # ru_maxrss is in KiB on Linux
+    print(f"\nUsers: {args.users:,}   wall time: {elapsed:.2f}s   "
+          f"throughput: {args.users / elapsed:.1f} conversations/s   peak RSS: {peak_rss_mb:.1f} MiB")
+    print(f"Handler invocations: {client.handler_calls:,}   messages sent: {client.messages_sent:,} "
+          f"(all delivered after {drained:.2f}s)   flood waits: {client.flood_waits:,}")
+    stats = server.stats
+    print(f"Experian stand-in: {stats.report_requests:,} report and {stats.token_requests} token requests, "
+          f"{stats.throttles_injected} x 429, {stats.errors_injected} x 503, {stats.connections} connections\n")
+    print(f"{'stage':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, samples in timer.samples.items():
+        ordered = sorted(samples)
+        print(f"{stage:<16}{len(ordered):>8}" + "".join(
+            f"{value * 1000:>10.2f}" for value in (percentile(ordered, 50), percentile(ordered, 95),
+                                                   percentile(ordered, 99), ordered[-1])))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000, help="Simulated users completing the flow")
+    parser.add_argument('--concurrency', type=int, default=2000, help="Users active at the same time")
+    parser.add_argument('--noise', type=int, default=2000, help="Unrelated group messages sent before the run")
+    parser.add_argument('--latency', type=float, default=0.2, help="Mean Experian report latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of reports failing with 503")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of reports throttled with 429")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="Retry-After sent with injected 429s")
+    parser.add_argument('--send-latency', type=float, default=0.0, help="Simulated Telegram send latency in seconds")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="Fraction of Telegram sends failing with a flood wait")
+    parser.add_argument('--flood-wait', type=int, default=1, help="Seconds of each injected flood wait")
+    # Telegram's own limits are about 30 messages/s overall and 1/s per chat; simulated users reply instantly
+    parser.add_argument('--telegram-rate', type=float, default=1000, help="Outgoing messages per second, all chats")
+    parser.add_argument('--chat-rate', type=float, default=100, help="Outgoing messages per second to one chat")
+    parser.add_argument('--experian-concurrency', type=int, default=config.EXPERIAN_MAX_CONCURRENCY)
+    parser.add_argument('--rate-limit', type=float, default=config.EXPERIAN_RATE_LIMIT)
+    parser.add_argument('--state-backend', default='memory', choices=['memory', 'sqlite'])
+    parser.add_argument('--sqlite-path', default='bench_state.sqlite3')
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Local stand-in for the Experian API, for load tests and benchmarks.
+Serves the OAuth token and /consumer/credit-report endpoints with
+configurable latency, error rate and HTTP 429 injection.
+
+Usage: python benchmarks/mock_experian.py [--port 8099] [--latency 0.2] [--error-rate 0.01] [--throttle-rate 0.01]
+"""
+import argparse
+import asyncio
+import json
+import random
+from dataclasses import dataclass, field
+
+@dataclass
+class MockExperianStats:
+    token_requests: int = 0
+    report_requests: int = 0
+    errors_injected: int = 0
+    throttles_injected: int = 0
+    connections: int = 0
+
+@dataclass
+class MockExperianServer:
+    """Minimal HTTP/1.1 server with keep-alive, imitating the Experian endpoints used by the bot."""
+    host: str = '127.0.0.1'
+    port: int = 0 # 0 picks a free port
+    latency: float = 0.2 # Mean credit report latency in seconds
+    jitter: float = 0.1 # Latency varies uniformly by +/- this fraction
+    error_rate: float = 0.0 # Fraction of report requests answered with HTTP 503
+    throttle_rate: float = 0.0 # Fraction of report requests answered with HTTP 429
+    retry_after: float = 1.0
+    token_lifetime: int = 3600
+    stats: MockExperianStats = field(default_factory=MockExperianStats)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, extra_headers, payload = await self._route(method, path, body)
+                data = json.dumps(payload).encode()
+                head = [f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}",
+                        "Content-Type: application/json", f"Content-Length: {len(data)}"]
+                head += [f"{name}: {value}" for name, value in extra_headers.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, body: bytes):
+        if method == 'POST' and path.endswith('/oauth2/v1/token'):
+            self.stats.token_requests += 1
+            await asyncio.sleep(self.latency / 4)
+            return 200, {}, {"access_token": "mock-token", "token_type": "Bearer", "expires_in": self.token_lifetime}
+
+        if method == 'POST' and path.endswith('/consumer/credit-report'):
+            self.stats.report_requests += 1
+            await asyncio.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+            roll = random.random()
+            if roll < self.throttle_rate:
+                self.stats.throttles_injected += 1
+                return 429, {"Retry-After": f"{self.retry_after:g}"}, {"error": "Too Many Requests"}
+            if roll < self.throttle_rate + self.error_rate:
+                self.stats.errors_injected += 1
+                return 503, {}, {"error": "Service Unavailable"}
+            request = json.loads(body or b'{}')
+            score = 300 + sum(map(ord, request.get('lastName') or '')) % 550
+            return 200, {}, {
+                "creditScore": score,
+                "riskLevel": "Low" if score >= 700 else "Medium" if score >= 580 else "High",
+                "summary": "Mock credit report generated by the local Experian stand-in.",
+                # Padding to approximate the size of a real credit report
+                "tradelines": [{"account": i, "balance": i * 100, "status": "open"} for i in range(200)]
+            }
+
+        return 404, {}, {"error": "Not Found"}
+
+
+async def _serve(args):
+    server = await MockExperianServer(port=args.port, latency=args.latency, error_rate=args.error_rate,
+                                      throttle_rate=args.throttle_rate).start()
+    print(f"Mock Experian API listening on {server.base_url}")
+    await asyncio.Event().wait()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
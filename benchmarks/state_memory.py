@@ -0,0 +1,65 @@
+"""
+Compares the memory used per tracked user by the original nested-dict
+conversation state and by the slotted ConversationState records.
+
+Usage: python benchmarks/state_memory.py [number_of_users]
+"""
+import asyncio
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_state import Step  # noqa: E402
+from state_manager import StateManager  # noqa: E402
+
+SAMPLE_DATA = {
+    'first_name': 'Jane', 'last_name': 'Doe', 'address': '123 Main St',
+    'city': 'Springfield', 'state': 'IL', 'zip_code': '62701',
+}
+
+def measure(build) -> int:
+    """Returns the bytes still allocated after running build()."""
+    gc.collect()
+    tracemalloc.start()
+    keep = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del keep
+    return current
+
+def build_dict_states(users: int, with_data: bool) -> dict:
+    """The original layout: {user_id: {'step': str, 'data': {}}}."""
+    states = {}
+    for user_id in range(users):
+        states[user_id] = {'step': 'ask_first_name', 'data': {}}
+        if with_data:
+            states[user_id]['step'] = 'ask_dob'
+            for key, value in SAMPLE_DATA.items():
+                states[user_id]['data'][key] = value
+    return states
+
+def build_slotted_states(users: int, with_data: bool) -> StateManager:
+    async def fill():
+        for user_id in range(users):
+            await manager.set_state(user_id, Step.ASK_FIRST_NAME)
+            if with_data:
+                await manager.set_state(user_id, Step.ASK_DOB, SAMPLE_DATA)
+    manager = StateManager()
+    asyncio.run(fill())
+    return manager
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"Tracked users: {users:,}")
+    print(f"{'scenario':<28}{'dict (B/user)':>16}{'slotted (B/user)':>20}{'saving':>10}")
+    for label, with_data in (("idle (first step)", False), ("mid-flow (6 fields)", True)):
+        old = measure(lambda: build_dict_states(users, with_data)) / users
+        new = measure(lambda: build_slotted_states(users, with_data)) / users
+        print(f"{label:<28}{old:>16.1f}{new:>20.1f}{(1 - new / old):>10.0%}")
+
+if __name__ == '__main__':
+    main()
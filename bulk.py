@@ -0,0 +1,274 @@
+"""
+Bulk credit checks for back-office workloads: reads customers from a CSV or
+JSONL file and writes one NDJSON result line per record.
+
+Usage: python bulk.py customers.csv results.ndjson [--concurrency 4] [--rate-limit 5] [--resume]
+
+CSV files need a header row. Records use the same field names as the bot
+(first_name, last_name, address, city, state, zip_code, dob and optionally ssn);
+an `id` field, if present, is copied to the output so results can be matched up.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+from typing import Iterator
+from config import reload_settings_async, EXPERIAN_MAX_CONCURRENCY, EXPERIAN_RATE_LIMIT
+from conversation_flow import FLOW
+from credit_report import CreditReport
+from dispatcher import ExperianDispatcher
+from experian_api import create_http_client, close_http_client, token_manager
+
+logger = logging.getLogger(__name__)
+
+# --- Input ---
+# Records are read one at a time, so files of any size use constant memory.
+
+class InvalidRecord:
+    """Stands in for a JSONL line that is not a JSON object, so it gets an error line and record numbers stay aligned."""
+    def __init__(self, line_number: int, error: str):
+        self.line_number = line_number
+        self.error = error
+
+    def __str__(self):
+        return f"line {self.line_number}: {self.error}"
+
+def read_records(path: str, fmt: str | None = None) -> Iterator[dict | InvalidRecord]:
+    """Yields the records of a CSV or JSONL file, detecting the format from the extension."""
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+    # utf-8-sig also reads files starting with a byte order mark, as Excel writes them
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if fmt == 'csv':
+            for row in csv.DictReader(f):
+                yield {key.strip(): value for key, value in row.items() if key}
+        else:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    # e.msg names the problem without quoting the line, which may hold customer data
+                    yield InvalidRecord(line_number, f"invalid JSON ({e.msg} at column {e.colno})")
+                    continue
+                if not isinstance(record, dict):
+                    yield InvalidRecord(line_number, f"expected a JSON object, got {type(record).__name__}")
+                    continue
+                yield record
+
+# Fields checked with the same validators as the conversation; the SSN is optional
+_VALIDATED_FIELDS = {step.field: step.validator for step in FLOW.values() if step.field and step.validator}
+
+def validate_record(record: dict) -> str | None:
+    """Returns why the record can't be checked, or None if it is valid."""
+    for field, validator in _VALIDATED_FIELDS.items():
+        value = record.get(field)
+        if field == 'ssn' and not value:
+            continue
+        error = validator(str(value or ''))
+        if error:
+            return f"{field}: {error.replace('**', '')}"
+    return None
+
+def customer_data(record: dict) -> dict:
+    """Keeps only the fields sent to Experian, with blank values treated as missing."""
+    return {field: str(record[field]).strip() for field in _VALIDATED_FIELDS if record.get(field)}
+
+
+# --- Checkpoints ---
+# The output file is the record of what has been done. The checkpoint file
+# remembers how far into the output everything is accounted for: every record
+# below `watermark`, plus those in `completed`. On resume only the output
+# written after `output_offset` has to be re-read.
+
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+        self.watermark = 0 # Every record below this has a result
+        self.completed: set[int] = set() # Records at or above the watermark that have a result
+        self.output_offset = 0
+
+    def mark_done(self, record: int):
+        self.completed.add(record)
+        while self.watermark in self.completed:
+            self.completed.remove(self.watermark)
+            self.watermark += 1
+
+    def is_done(self, record: int) -> bool:
+        return record < self.watermark or record in self.completed
+
+    def load(self, output_path: str):
+        """Restores progress from the checkpoint file and any output written after it."""
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+            self.watermark = saved['watermark']
+            self.completed = set(saved['completed'])
+            self.output_offset = saved['output_offset']
+        if not os.path.exists(output_path):
+            return
+        with open(output_path, 'r+b') as out:
+            out.seek(self.output_offset)
+            offset = self.output_offset
+            for line in out:
+                if not line.endswith(b'\n'):
+                    break # Partial line from an interrupted run
+                self.mark_done(json.loads(line)['record'])
+                offset += len(line)
+            out.truncate(offset)
+
+    def save(self, output_offset: int):
+        self.output_offset = output_offset
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'watermark': self.watermark, 'completed': sorted(self.completed),
+                       'output_offset': output_offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+# --- Bulk Runner ---
+
+class BulkStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+
+    @property
+    def finished(self) -> int:
+        return self.succeeded + self.failed
+
+    def rate(self) -> float:
+        return self.finished / max(time.monotonic() - self.started, 1e-9)
+
+    def summary(self) -> str:
+        return (f"{self.finished} checked ({self.succeeded} ok, {self.failed} failed), "
+                f"{self.skipped} already done, {self.rate():.1f} records/s")
+
+
+async def run_bulk(input_path: str, output_path: str, dispatcher: ExperianDispatcher | None = None,
+                   input_format: str | None = None, resume: bool = False,
+                   checkpoint_interval: float = 5.0, progress_interval: float = 10.0) -> BulkStats:
+    """
+    Runs a credit check for every record in `input_path` through the dispatcher (and so
+    through the same concurrency cap, rate limiter, retries and token as the bot),
+    appending one NDJSON line per record to `output_path` in completion order.
+    """
+    dispatcher = dispatcher or ExperianDispatcher()
+    checkpoint = Checkpoint(output_path + '.checkpoint')
+    if resume:
+        checkpoint.load(output_path)
+    elif os.path.exists(checkpoint.path):
+        os.remove(checkpoint.path)
+
+    stats = BulkStats()
+    # Keep just enough records in flight to saturate the dispatcher, so memory stays flat.
+    # The dispatcher's queue must have room for the records waiting beyond its concurrency.
+    window = asyncio.Semaphore(dispatcher.concurrency * 2)
+    tasks: set[asyncio.Task] = set()
+    last_checkpoint = last_progress = time.monotonic()
+
+    with open(output_path, 'ab' if resume else 'wb') as out:
+        def write_result(index: int, record: dict, result: CreditReport | None, error: str | None):
+            entry = {'record': index, 'id': record.get('id')}
+            if error:
+                entry['error'] = error
+                stats.failed += 1
+            else:
+                entry['result'] = result.to_dict() # type: ignore
+                stats.succeeded += 1
+            out.write(json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n')
+            checkpoint.mark_done(index)
+
+        def save_checkpoint():
+            # The results must be on disk before the checkpoint that counts them
+            out.flush()
+            os.fsync(out.fileno())
+            checkpoint.save(out.tell())
+
+        async def check(index: int, record: dict):
+            try:
+                result = await dispatcher.submit(customer_data(record))
+            except Exception as e:
+                logger.error("Bulk credit check for record %d failed: %s", index, e)
+                result = {"error": f"An unexpected error occurred: {e}"}
+            try:
+                if isinstance(result, CreditReport):
+                    write_result(index, record, result, None)
+                else:
+                    write_result(index, record, None, result.get('error') or "An unknown error occurred.")
+            finally:
+                window.release()
+
+        try:
+            for index, record in enumerate(read_records(input_path, input_format)):
+                if checkpoint.is_done(index):
+                    stats.skipped += 1
+                    continue
+                if isinstance(record, InvalidRecord):
+                    write_result(index, {}, None, str(record))
+                    continue
+                error = validate_record(record)
+                if error:
+                    write_result(index, record, None, error)
+                    continue
+
+                await window.acquire()
+                stats.submitted += 1
+                task = asyncio.create_task(check(index, record))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+                now = time.monotonic()
+                if now - last_checkpoint >= checkpoint_interval:
+                    save_checkpoint()
+                    last_checkpoint = now
+                if now - last_progress >= progress_interval:
+                    logger.info("Bulk progress: %s; %d in flight.", stats.summary(), len(tasks))
+                    last_progress = now
+
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            # On interruption, stop before the output is closed; --resume picks up from here
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.wait(tasks)
+        save_checkpoint()
+
+    logger.info("Bulk run finished: %s.", stats.summary())
+    return stats
+
+
+async def main(args):
+    await reload_settings_async()
+    create_http_client()
+    dispatcher = ExperianDispatcher(concurrency=args.concurrency, queue_size=args.concurrency * 2,
+                                    rate_limit=args.rate_limit)
+    try:
+        stats = await run_bulk(args.input, args.output, dispatcher, input_format=args.format,
+                               resume=args.resume, progress_interval=args.progress_interval)
+        print(stats.summary())
+    finally:
+        await dispatcher.stop()
+        await token_manager.close()
+        await close_http_client()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help="CSV or JSONL file of customer records")
+    parser.add_argument('output', help="NDJSON file to write results to")
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help="Input format (default: from the file extension)")
+    parser.add_argument('--concurrency', type=int, default=EXPERIAN_MAX_CONCURRENCY, help="Credit checks in flight at once")
+    parser.add_argument('--rate-limit', type=float, default=EXPERIAN_RATE_LIMIT, help="Maximum requests per second to Experian")
+    parser.add_argument('--resume', action='store_true', help="Continue an interrupted run, skipping records already in the output")
+    parser.add_argument('--progress-interval', type=float, default=10.0, help="Seconds between progress log lines")
+    asyncio.run(main(parser.parse_args()))
@@ -1,6 +1,12 @@
 import os
+import asyncio
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
 import keyring # Import keyring
+from logging_config import setup_logging
+from metrics import track_upstream
 
 # --- Configuration ---
 # Get your API ID and API Hash from my.telegram.org
@@ -22,13 +28,71 @@ SERVICE_EXPERIAN_CLIENT_SECRET = 'experian_client_secret'
 SERVICE_EXPERIAN_USERNAME = 'experian_username'
 SERVICE_EXPERIAN_PASSWORD = 'experian_password'
 
+SERVICE_STATE_ENCRYPTION_KEY = 'state_encryption_key' # Encrypts conversation state in the sqlite/redis backends
+
 # Default base URL for Experian API if not found in keyring
 DEFAULT_EXPERIAN_API_BASE_URL = 'https://api.experian.com/credit-risk/v1'
 
+# --- Experian HTTP Client Settings ---
+# Connection pool and timeout settings for the shared Experian HTTP client
+EXPERIAN_MAX_CONNECTIONS = int(os.getenv('EXPERIAN_MAX_CONNECTIONS', '20'))
+EXPERIAN_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('EXPERIAN_MAX_KEEPALIVE_CONNECTIONS', '10'))
+EXPERIAN_KEEPALIVE_EXPIRY = float(os.getenv('EXPERIAN_KEEPALIVE_EXPIRY', '30'))
+EXPERIAN_HTTP2 = os.getenv('EXPERIAN_HTTP2', 'false').lower() in ('1', 'true', 'yes') # Requires the 'h2' package
+EXPERIAN_CONNECT_TIMEOUT = float(os.getenv('EXPERIAN_CONNECT_TIMEOUT', '5'))
+EXPERIAN_WRITE_TIMEOUT = float(os.getenv('EXPERIAN_WRITE_TIMEOUT', '10'))
+EXPERIAN_POOL_TIMEOUT = float(os.getenv('EXPERIAN_POOL_TIMEOUT', '5'))
+EXPERIAN_TOKEN_READ_TIMEOUT = float(os.getenv('EXPERIAN_TOKEN_READ_TIMEOUT', '10'))
+EXPERIAN_REPORT_READ_TIMEOUT = float(os.getenv('EXPERIAN_REPORT_READ_TIMEOUT', '30'))
+
+# --- Experian Request Dispatching ---
+EXPERIAN_MAX_CONCURRENCY = int(os.getenv('EXPERIAN_MAX_CONCURRENCY', '4')) # Credit checks in flight at once
+EXPERIAN_QUEUE_SIZE = int(os.getenv('EXPERIAN_QUEUE_SIZE', '100')) # Checks allowed to wait for a free slot
+EXPERIAN_RATE_LIMIT = float(os.getenv('EXPERIAN_RATE_LIMIT', '5')) # Maximum requests per second to Experian
+EXPERIAN_QUEUE_UPDATE_INTERVAL = float(os.getenv('EXPERIAN_QUEUE_UPDATE_INTERVAL', '15')) # Seconds between queue position updates
+EXPERIAN_WORKER_PROCESSES = int(os.getenv('EXPERIAN_WORKER_PROCESSES', '0')) # Run credit checks in this many worker processes (0 = in the bot process)
+
+# --- Outgoing Telegram Messages ---
+TELEGRAM_GLOBAL_RATE_LIMIT = float(os.getenv('TELEGRAM_GLOBAL_RATE_LIMIT', '30')) # Messages per second across all chats
+TELEGRAM_CHAT_RATE_LIMIT = float(os.getenv('TELEGRAM_CHAT_RATE_LIMIT', '1')) # Messages per second to one chat
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '3')) # Messages one chat may receive back to back
+
+# --- Experian Resilience ---
+EXPERIAN_RETRY_ATTEMPTS = int(os.getenv('EXPERIAN_RETRY_ATTEMPTS', '3')) # Total attempts for retryable failures
+EXPERIAN_RETRY_BASE_DELAY = float(os.getenv('EXPERIAN_RETRY_BASE_DELAY', '0.2'))
+EXPERIAN_RETRY_MAX_DELAY = float(os.getenv('EXPERIAN_RETRY_MAX_DELAY', '5'))
+# Hedging sends a second request when the first is slower than usual; each request may be billed
+EXPERIAN_HEDGE_ENABLED = os.getenv('EXPERIAN_HEDGE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+EXPERIAN_BREAKER_FAILURE_THRESHOLD = int(os.getenv('EXPERIAN_BREAKER_FAILURE_THRESHOLD', '5'))
+EXPERIAN_BREAKER_RESET_TIMEOUT = float(os.getenv('EXPERIAN_BREAKER_RESET_TIMEOUT', '30'))
+
+# --- Experian Result Cache ---
+EXPERIAN_CACHE_TTL = float(os.getenv('EXPERIAN_CACHE_TTL', '300')) # Seconds a successful result is reused (0 disables)
+EXPERIAN_CACHE_MAX_ENTRIES = int(os.getenv('EXPERIAN_CACHE_MAX_ENTRIES', '1000'))
+
+# --- Metrics ---
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+# Seconds after which the in-memory settings snapshot is reloaded from keyring (0 disables)
+SETTINGS_TTL = float(os.getenv('SETTINGS_TTL', '0'))
+
+# Seconds to wait for in-flight credit checks on shutdown before giving up on them
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '30'))
+
+# --- Conversation State Storage ---
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory') # 'memory', 'sqlite' or 'redis'
+STATE_TTL = float(os.getenv('STATE_TTL', '3600')) # Seconds before an idle conversation is evicted
+STATE_SQLITE_PATH = os.getenv('STATE_SQLITE_PATH', 'bot_state.sqlite3')
+STATE_REDIS_URL = os.getenv('STATE_REDIS_URL', 'redis://localhost:6379/0')
+
 # --- Logging Setup ---
-# Configure logging for the entire application
-logging.basicConfig(format='[%(levelname) 5s/%(asctime)s] %(name)s: %(message)s',
-                    level=logging.INFO) # Set to INFO for more detailed bot logs
+# Configure logging for the entire application. Records are written by a background
+# thread (see logging_config.py), with PII redacted, so logging never blocks the bot.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper() # Set to INFO for more detailed bot logs
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text') # 'text' or 'json'
+setup_logging(LOG_LEVEL, LOG_FORMAT)
 
 def get_secret(service_id: str, username: str = 'default_user') -> str | None:
     """
@@ -37,12 +101,12 @@ def get_secret(service_id: str, username: str = 'default_user') -> str | None:
     try:
         secret = keyring.get_password(service_id, username)
         if secret:
-            logging.info(f"Secret for service '{service_id}' retrieved successfully.")  # Do not log the secret itself
+            logging.info("Secret for service '%s' retrieved successfully.", service_id)  # Do not log the secret itself
         else:
-            logging.warning(f"Secret for service '{service_id}' not found in keyring.")
+            logging.warning("Secret for service '%s' not found in keyring.", service_id)
         return secret
     except Exception as e:
-        logging.error(f"Error retrieving secret for service '{service_id}' from keyring: {e}")
+        logging.error("Error retrieving secret for service '%s' from keyring: %s", service_id, e)
         return None
 
 def set_secret(service_id: str, secret: str, username: str = 'default_user'):
@@ -51,6 +115,101 @@ def set_secret(service_id: str, secret: str, username: str = 'default_user'):
     """
     try:
         keyring.set_password(service_id, username, secret)
-        logging.info(f"Secret for service '{service_id}' set successfully.")  # Do not log the secret itself
+        logging.info("Secret for service '%s' set successfully.", service_id)  # Do not log the secret itself
     except Exception as e:
-        logging.error(f"Error setting secret for service '{service_id}' in keyring: {e}")
\ No newline at end of file
+        logging.error("Error setting secret for service '%s' in keyring: %s", service_id, e)
+
+# --- Settings Snapshot ---
+# Secrets are read from keyring once and kept in memory, so request handlers
+# never block the event loop on a keyring lookup.
+
+@dataclass(frozen=True)
+class Settings:
+    """Immutable snapshot of all credentials and endpoints used by the bot."""
+    telegram_api_id: str | None
+    telegram_api_hash: str | None
+    telegram_bot_token: str | None
+    experian_api_base_url: str
+    experian_client_id: str | None
+    experian_client_secret: str | None
+    experian_username: str | None
+    experian_password: str | None
+    loaded_at: float
+    state_encryption_key: str | None = None
+
+    @property
+    def experian_credentials_configured(self) -> bool:
+        return all([self.experian_client_id, self.experian_client_secret,
+                    self.experian_username, self.experian_password])
+
+_settings: Settings | None = None
+
+def load_settings() -> Settings:
+    """
+    Reads all secrets from keyring (falling back to environment variables for
+    Telegram credentials) and returns a new settings snapshot.
+    """
+    with track_upstream('keyring'):
+        return _read_settings()
+
+_SECRET_SERVICES = (
+    SERVICE_TELEGRAM_API_ID, SERVICE_TELEGRAM_API_HASH, SERVICE_TELEGRAM_BOT_TOKEN,
+    SERVICE_EXPERIAN_API_BASE_URL, SERVICE_EXPERIAN_CLIENT_ID, SERVICE_EXPERIAN_CLIENT_SECRET,
+    SERVICE_EXPERIAN_USERNAME, SERVICE_EXPERIAN_PASSWORD, SERVICE_STATE_ENCRYPTION_KEY,
+)
+
+def _read_settings() -> Settings:
+    # Keyring lookups can each take a round trip to the OS secret store, so they run concurrently
+    with ThreadPoolExecutor(max_workers=len(_SECRET_SERVICES), thread_name_prefix='keyring') as executor:
+        secrets = dict(zip(_SECRET_SERVICES, executor.map(get_secret, _SECRET_SERVICES)))
+    return Settings(
+        telegram_api_id=secrets[SERVICE_TELEGRAM_API_ID] or TELEGRAM_API_ID,
+        telegram_api_hash=secrets[SERVICE_TELEGRAM_API_HASH] or TELEGRAM_API_HASH,
+        telegram_bot_token=secrets[SERVICE_TELEGRAM_BOT_TOKEN] or TELEGRAM_BOT_TOKEN,
+        experian_api_base_url=secrets[SERVICE_EXPERIAN_API_BASE_URL] or DEFAULT_EXPERIAN_API_BASE_URL,
+        experian_client_id=secrets[SERVICE_EXPERIAN_CLIENT_ID],
+        experian_client_secret=secrets[SERVICE_EXPERIAN_CLIENT_SECRET],
+        experian_username=secrets[SERVICE_EXPERIAN_USERNAME],
+        experian_password=secrets[SERVICE_EXPERIAN_PASSWORD],
+        loaded_at=time.monotonic(),
+        state_encryption_key=secrets[SERVICE_STATE_ENCRYPTION_KEY]
+    )
+
+def reload_settings() -> Settings:
+    """Replaces the current settings snapshot with a fresh one from keyring."""
+    global _settings
+    _settings = load_settings()
+    logging.info("Settings snapshot loaded from keyring.")
+    return _settings
+
+def set_settings(settings: Settings):
+    """Installs a settings snapshot directly, e.g. to point the bot at a local Experian stand-in."""
+    global _settings
+    _settings = settings
+
+def get_settings() -> Settings:
+    """Returns the current settings snapshot, loading it on first use."""
+    if _settings is None:
+        return reload_settings()
+    return _settings
+
+async def reload_settings_async() -> Settings:
+    """Reloads settings in a worker thread, since keyring access is blocking."""
+    return await asyncio.to_thread(reload_settings)
+
+async def refresh_settings_periodically(ttl: float = SETTINGS_TTL, on_change=None):
+    """
+    Reloads the settings snapshot every `ttl` seconds. Does nothing if ttl is 0.
+    If the secrets differ from the previous snapshot, awaits `on_change()` so they take effect.
+    """
+    if ttl <= 0:
+        return
+    while True:
+        await asyncio.sleep(ttl)
+        previous = get_settings()
+        settings = await reload_settings_async()
+        if on_change and replace(settings, loaded_at=previous.loaded_at) != previous:
+            try:
+                await on_change()
+            except Exception as e:
+                logging.error("Failed to apply reloaded settings: %s", e)
@@ -0,0 +1,120 @@
+import dataclasses
+import re
+from dataclasses import dataclass
+from datetime import date
+from typing import Callable
+from telethon import Button
+from conversation_state import Step
+
+# --- Conversation Flow ---
+# The credit check conversation as a table: each step names the field it
+# collects, the prompt that asks for it, an optional validator and the step
+# that follows. TelegramBot dispatches on this table, so changing the flow
+# only means editing FLOW.
+
+# A validator returns an error message for invalid input, or None if the input is accepted
+Validator = Callable[[str], str | None]
+
+def validate_not_blank(value: str) -> str | None:
+    if not value.strip():
+        return "This field cannot be empty. Please try again."
+    return None
+
+def validate_date_of_birth(value: str) -> str | None:
+    try:
+        dob = date.fromisoformat(value.strip())
+    except ValueError:
+        return "Please enter your date of birth in the format **YYYY-MM-DD**."
+    if dob >= date.today():
+        return "Your date of birth must be in the past. Please try again."
+    return None
+
+_ZIP_CODE_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9 -]{1,9}$')
+_SSN_RE = re.compile(r'^\d{3}-?\d{2}-?\d{4}$')
+
+def validate_zip_code(value: str) -> str | None:
+    if not _ZIP_CODE_RE.match(value.strip()):
+        return "That doesn't look like a valid zip/postal code. Please try again."
+    return None
+
+def validate_ssn(value: str) -> str | None:
+    if not _SSN_RE.match(value.strip()):
+        return "Please enter your SSN in the format **XXX-XX-XXXX**."
+    return None
+
+
+@dataclass(frozen=True, slots=True)
+class Choice:
+    """
+    An inline button answer: the value stored for the step's field and the next step.
+    The button message is replaced by `reply`, or by the next step's prompt if no reply is given.
+    """
+    label: str
+    value: str | None
+    next_step: Step | None # None completes the flow
+    reply: str | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class FlowStep:
+    """
+    One step of the conversation. Text steps store the user's message in `field`;
+    steps with `choices` are answered with inline buttons instead.
+    A `next_step` of None means the flow is complete once this step is answered.
+    """
+    prompt: str
+    field: str | None = None
+    validator: Validator | None = None
+    next_step: Step | None = None
+    choices: dict[bytes, Choice] = dataclasses.field(default_factory=dict)
+
+    @property
+    def buttons(self):
+        if not self.choices:
+            return None
+        return [[Button.inline(choice.label, data)] for data, choice in self.choices.items()]
+
+
+FLOW: dict[Step, FlowStep] = {
+    Step.ASK_FIRST_NAME: FlowStep(
+        prompt="Okay, let's start the credit check. What is your **first name**?",
+        field='first_name', validator=validate_not_blank, next_step=Step.ASK_LAST_NAME),
+    Step.ASK_LAST_NAME: FlowStep(
+        prompt="Thanks! What is your **last name**?",
+        field='last_name', validator=validate_not_blank, next_step=Step.ASK_ADDRESS),
+    Step.ASK_ADDRESS: FlowStep(
+        prompt="Please provide your **street address** (e.g., 123 Main St).",
+        field='address', validator=validate_not_blank, next_step=Step.ASK_CITY),
+    Step.ASK_CITY: FlowStep(
+        prompt="What is your **city**?",
+        field='city', validator=validate_not_blank, next_step=Step.ASK_STATE),
+    Step.ASK_STATE: FlowStep(
+        prompt="What is your **state/province** (e.g., CA, NY)?",
+        field='state', validator=validate_not_blank, next_step=Step.ASK_ZIP_CODE),
+    Step.ASK_ZIP_CODE: FlowStep(
+        prompt="What is your **zip/postal code**?",
+        field='zip_code', validator=validate_zip_code, next_step=Step.ASK_DOB),
+    Step.ASK_DOB: FlowStep(
+        prompt="What is your **date of birth** (YYYY-MM-DD)?",
+        field='dob', validator=validate_date_of_birth, next_step=Step.ASK_SSN_CONSENT),
+    # Crucial: Ask for SSN consent and explain its sensitivity
+    Step.ASK_SSN_CONSENT: FlowStep(
+        prompt=(
+            "To get the most accurate credit risk data, we typically need your **Social Security Number (SSN)**. "
+            "**WARNING:** Providing your SSN is highly sensitive. It will be transmitted securely to Experian. "
+            "We do not store your SSN. "
+            "Do you consent to provide your SSN? (Yes/No)"
+        ),
+        field='ssn',
+        choices={
+            b'consent_ssn_yes': Choice("Yes, provide SSN", None, Step.ASK_SSN),
+            b'consent_ssn_no': Choice("No, skip SSN", None, None,
+                                      "You chose not to provide your SSN. Proceeding without it."),
+        }),
+    # The SSN completes the flow and is passed straight to Experian without being written to the state store
+    Step.ASK_SSN: FlowStep(
+        prompt="Please enter your **Social Security Number (SSN)**. (e.g., XXX-XX-XXXX).",
+        field='ssn', validator=validate_ssn, next_step=None),
+}
+
+FIRST_STEP = Step.ASK_FIRST_NAME
@@ -0,0 +1,71 @@
+from dataclasses import dataclass, fields, replace
+from enum import Enum
+
+# --- Conversation State Records ---
+# One compact, immutable record per user. Updates return a new record, so a
+# record can be shared safely (e.g. the interned INITIAL_STATE) and never
+# changes underneath a handler that is still reading it.
+
+class Step(str, Enum):
+    """Steps of the credit check conversation. Values match the stored step names."""
+    INITIAL = 'initial'
+    ASK_FIRST_NAME = 'ask_first_name'
+    ASK_LAST_NAME = 'ask_last_name'
+    ASK_ADDRESS = 'ask_address'
+    ASK_CITY = 'ask_city'
+    ASK_STATE = 'ask_state'
+    ASK_ZIP_CODE = 'ask_zip_code'
+    ASK_DOB = 'ask_dob'
+    ASK_SSN_CONSENT = 'ask_ssn_consent'
+    ASK_SSN = 'ask_ssn'
+
+
+@dataclass(frozen=True, slots=True)
+class ConversationState:
+    """The current step and the customer data collected so far for one user."""
+    step: Step = Step.INITIAL
+    first_name: str | None = None
+    last_name: str | None = None
+    address: str | None = None
+    city: str | None = None
+    state: str | None = None
+    zip_code: str | None = None
+    dob: str | None = None
+    ssn: str | None = None
+
+    @property
+    def data(self) -> dict:
+        """The collected customer data, keyed by field name."""
+        return {name: getattr(self, name) for name in DATA_FIELDS if getattr(self, name) is not None}
+
+    def with_step(self, step: Step | str) -> 'ConversationState':
+        if self is _EMPTY_STATES[self.step]:
+            # No data collected yet, so every user at this step can share one record
+            return _EMPTY_STATES[Step(step)]
+        return replace(self, step=Step(step))
+
+    def with_data(self, **data) -> 'ConversationState':
+        return replace(self, **data)
+
+    def to_dict(self) -> dict:
+        """
+        Serialises the record in the {'step': ..., 'data': {...}} layout used by persistent stores.
+        The SSN is left out: it is never persisted.
+        """
+        return {'step': self.step.value, 'data': {k: v for k, v in self.data.items() if k in PERSISTED_FIELDS}}
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> 'ConversationState':
+        data = {k: v for k, v in raw.get('data', {}).items() if k in PERSISTED_FIELDS}
+        return cls(Step(raw.get('step', Step.INITIAL)), **data)
+
+
+DATA_FIELDS = tuple(f.name for f in fields(ConversationState) if f.name != 'step')
+# Fields written to persistent stores
+PERSISTED_FIELDS = frozenset(DATA_FIELDS) - {'ssn'}
+
+# Interned records for users who have not entered any data yet, one per step
+_EMPTY_STATES = {step: ConversationState(step) for step in Step}
+
+# Shared default returned for users without a conversation, instead of a fresh object per lookup
+INITIAL_STATE = _EMPTY_STATES[Step.INITIAL]
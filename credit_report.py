@@ -0,0 +1,139 @@
+import json
+from dataclasses import dataclass, asdict
+from typing import AsyncIterator
+
+try:
+    import ijson # Optional: incremental parsing, so the full report is never held in memory
+except ImportError:
+    ijson = None
+
+try:
+    import orjson # Optional: faster parsing when the whole body has to be read
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# --- Credit Report Parsing ---
+# Credit report responses are large, but the bot only needs a few top-level
+# fields. The response is parsed as it streams in; the declared fields are
+# validated and kept, and everything else is discarded without being built.
+# Both parsing paths accept and reject the same responses.
+
+class ReportSchemaError(ValueError):
+    """The credit report response is not valid JSON or does not match REPORT_FIELDS."""
+
+
+@dataclass(frozen=True, slots=True)
+class CreditReport:
+    """The parts of an Experian credit report the bot uses."""
+    credit_score: int
+    risk_level: str | None = None
+    summary: str | None = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass(frozen=True, slots=True)
+class ReportField:
+    attribute: str # CreditReport attribute the value is stored in
+    type: type
+    required: bool = False
+
+
+# Top-level response fields to keep, by JSON key
+REPORT_FIELDS: dict[str, ReportField] = {
+    'creditScore': ReportField('credit_score', int, required=True),
+    'riskLevel': ReportField('risk_level', str),
+    'summary': ReportField('summary', str),
+}
+
+_SCALAR_EVENTS = frozenset({'null', 'boolean', 'number', 'string'})
+_CONTAINER_TYPES = {'start_map': 'dict', 'start_array': 'list'} # Named as _check names them
+
+def _check(key: str, value):
+    spec = REPORT_FIELDS[key]
+    if value is None:
+        if spec.required:
+            raise ReportSchemaError(f"'{key}' must not be null")
+        return None
+    # bool is a subclass of int, but never a valid score
+    if (isinstance(value, bool) and spec.type is not bool) or not isinstance(value, spec.type):
+        raise ReportSchemaError(f"'{key}' must be {spec.type.__name__}, got {type(value).__name__}")
+    return value
+
+def _build(values: dict) -> CreditReport:
+    for key, spec in REPORT_FIELDS.items():
+        if spec.required and key not in values:
+            raise ReportSchemaError(f"missing required field '{key}'")
+    return CreditReport(**{REPORT_FIELDS[key].attribute: value for key, value in values.items()})
+
+def parse_credit_report_bytes(body: bytes) -> CreditReport:
+    """Parses a complete response body."""
+    try:
+        document = _loads(body)
+    except ValueError as e: # Both json's and orjson's decode errors are ValueErrors
+        raise ReportSchemaError(f"invalid JSON ({e})") from e
+    if not isinstance(document, dict):
+        raise ReportSchemaError("expected a JSON object")
+    return _build({key: _check(key, document[key]) for key in REPORT_FIELDS if key in document})
+
+async def parse_credit_report(chunks: AsyncIterator[bytes]) -> CreditReport:
+    """
+    Parses a response body from its chunks. With ijson installed, only the declared
+    fields are built, but the whole body is still parsed, so a response is accepted
+    or rejected exactly as parse_credit_report_bytes would (e.g. trailing garbage is
+    an error, and the last of duplicate keys wins) however it is split into chunks.
+    Without ijson, the body is collected and parsed in one go.
+    """
+    if ijson is None:
+        body = bytearray()
+        async for chunk in chunks:
+            body += chunk
+        return parse_credit_report_bytes(bytes(body))
+
+    # basic_parse events carry no path, which is much cheaper than parse(); the
+    # nesting depth is tracked here to pick out the top-level keys
+    events = ijson.sendable_list()
+    parser = ijson.basic_parse_coro(events, use_float=True) # Floats, like json.loads, not Decimals
+    values = {}
+    depth = 0
+    key = None # Top-level key whose value comes next
+    started = False
+
+    def feed():
+        nonlocal depth, key, started
+        for event, value in events:
+            if key is not None:
+                if key in REPORT_FIELDS:
+                    if event not in _SCALAR_EVENTS:
+                        raise ReportSchemaError(f"'{key}' must be {REPORT_FIELDS[key].type.__name__}, got {_CONTAINER_TYPES[event]}")
+                    values[key] = _check(key, value)
+                key = None
+            if event == 'map_key':
+                if depth == 1:
+                    key = value
+            elif event == 'start_map' or event == 'start_array':
+                if not started:
+                    if event != 'start_map':
+                        raise ReportSchemaError("expected a JSON object")
+                    started = True
+                depth += 1
+            elif event == 'end_map' or event == 'end_array':
+                depth -= 1
+            elif not started:
+                raise ReportSchemaError("expected a JSON object")
+        del events[:]
+
+    try:
+        async for chunk in chunks:
+            parser.send(chunk)
+            feed()
+        parser.close()
+        feed()
+    except ijson.JSONError as e:
+        # ijson's messages quote the surrounding input, which may be report data
+        raise ReportSchemaError("invalid JSON") from e
+    if not started:
+        raise ReportSchemaError("expected a JSON object")
+    return _build(values)
@@ -0,0 +1,216 @@
+import asyncio
+import inspect
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+from config import (
+    EXPERIAN_MAX_CONCURRENCY,
+    EXPERIAN_QUEUE_SIZE,
+    EXPERIAN_RATE_LIMIT,
+    EXPERIAN_QUEUE_UPDATE_INTERVAL
+)
+from experian_api import call_experian_credit_risk_api
+from resilience import ResilientCaller
+
+logger = logging.getLogger(__name__)
+
+# Called with the job's position in the queue (1 = next to be processed)
+PositionCallback = Callable[[int], Awaitable[None]]
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket limiting requests per second. The rate is halved whenever the
+    upstream throttles us (honouring Retry-After) and recovers gradually after successes.
+    """
+    def __init__(self, rate: float, burst: int | None = None, min_rate: float = 0.2, recovery: float = 0.1,
+                 name: str = 'Experian'):
+        self.name = name # Upstream named in log messages
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.recovery = recovery # Requests/second regained per successful call
+        self.burst = burst or max(int(rate), 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Waits until a request may be sent."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.recovery)
+
+    def on_throttled(self, retry_after: float | None):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = 0.0
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        if retry_after:
+            logger.warning("%s is throttling requests; rate reduced to %.2f/s, pausing for %.1fs.",
+                           self.name, self.rate, retry_after)
+        else:
+            logger.warning("%s is throttling requests; rate reduced to %.2f/s.", self.name, self.rate)
+
+
+@dataclass
+class _Job:
+    customer_data: dict
+    sequence: int
+    future: asyncio.Future
+    on_position: PositionCallback | None = None
+    user_id: int | None = None
+    last_position: int | None = field(default=None)
+
+
+class ExperianDispatcher:
+    """
+    Runs Experian credit checks through a bounded queue served by a fixed number
+    of workers, so bursts of users never exceed the concurrency cap or the rate limit.
+    """
+    def __init__(self, call: Callable[[dict], Awaitable[dict]] | None = None,
+                 concurrency: int = EXPERIAN_MAX_CONCURRENCY, queue_size: int = EXPERIAN_QUEUE_SIZE,
+                 rate_limit: float = EXPERIAN_RATE_LIMIT, max_throttle_retries: int = 3,
+                 position_update_interval: float = EXPERIAN_QUEUE_UPDATE_INTERVAL):
+        # By default, Experian calls are retried and guarded by a circuit breaker
+        self.call = call or ResilientCaller(call_experian_credit_risk_api)
+        # Calls that route by user (e.g. WorkerPool.call) are given the submitting user's id
+        self._call_takes_user_id = 'user_id' in inspect.signature(self.call).parameters
+        self.concurrency = concurrency
+        self.max_throttle_retries = max_throttle_retries
+        self.position_update_interval = position_update_interval
+        self.rate_limiter = AdaptiveRateLimiter(rate_limit)
+        self._queue: asyncio.Queue[_Job] = asyncio.Queue(maxsize=queue_size)
+        self._waiting: dict[int, _Job] = {} # Queued jobs by sequence number, for position updates
+        self._submitted = 0 # Sequence number of the last queued job
+        self._dequeued = 0 # Sequence number of the last job taken by a worker
+        self._busy_workers = 0
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def queue_length(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def in_flight(self) -> int:
+        return self._busy_workers
+
+    def start(self):
+        """Starts the worker tasks. Called automatically on the first submit."""
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._report_positions()))
+
+    async def stop(self):
+        """Cancels the workers. Jobs still queued are answered with an error."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Empty the queue too, so workers started by a later submit() never run these jobs
+        while not self._queue.empty():
+            job = self._queue.get_nowait()
+            self._queue.task_done()
+            self._dequeued = job.sequence
+            if not job.future.done():
+                job.future.set_result({"error": "The service is shutting down. Please try again shortly."})
+        self._waiting.clear()
+
+    async def submit(self, customer_data: dict, on_position: PositionCallback | None = None,
+                     user_id: int | None = None) -> dict:
+        """
+        Queues a credit check and waits for its result. If the check has to wait for a
+        free worker, `on_position` is called with its place in the queue, and again
+        periodically while that place changes.
+        """
+        self.start()
+        self._submitted += 1
+        job = _Job(customer_data, self._submitted, asyncio.get_running_loop().create_future(), on_position, user_id)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._submitted -= 1
+            logger.warning("Experian request queue is full; rejecting credit check.")
+            return {"error": "The service is very busy right now. Please try again in a few minutes."}
+        self._waiting[job.sequence] = job
+
+        # Tell the user where they are if no worker is free to take the job right away
+        if self._busy_workers + self._queue.qsize() > self.concurrency:
+            await self._notify_position(job)
+        return await job.future
+
+    def _position(self, job: _Job) -> int:
+        return job.sequence - self._dequeued
+
+    async def _notify_position(self, job: _Job):
+        position = self._position(job)
+        if job.on_position is None or position == job.last_position or position < 1:
+            return
+        job.last_position = position
+        try:
+            await job.on_position(position)
+        except Exception as e:
+            logger.warning("Failed to send queue position update: %s", e)
+
+    async def _report_positions(self):
+        while True:
+            await asyncio.sleep(self.position_update_interval)
+            jobs = [job for job in self._waiting.values() if job.last_position is not None]
+            await asyncio.gather(*(self._notify_position(job) for job in jobs))
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job = await self._queue.get()
+            self._dequeued = job.sequence
+            self._waiting.pop(job.sequence, None)
+            self._busy_workers += 1
+            try:
+                result = await self._run(job)
+                if not job.future.done():
+                    job.future.set_result(result)
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.set_result({"error": "The service is shutting down. Please try again shortly."})
+                raise
+            except Exception as e:
+                logger.error("Experian dispatcher worker %s failed: %s", worker_id, e)
+                if not job.future.done():
+                    job.future.set_result({"error": f"An unexpected error occurred: {e}"})
+            finally:
+                self._busy_workers -= 1
+                self._queue.task_done()
+
+    async def _run(self, job: _Job) -> dict:
+        """Calls Experian, backing off and retrying while it responds with HTTP 429."""
+        for attempt in range(self.max_throttle_retries + 1):
+            await self.rate_limiter.acquire()
+            if self._call_takes_user_id:
+                result = await self.call(job.customer_data, user_id=job.user_id)
+            else:
+                result = await self.call(job.customer_data)
+            failed = isinstance(result, dict) and 'error' in result
+            if not failed:
+                self.rate_limiter.on_success()
+                return result
+            if result.get('status_code') != 429:
+                # Other errors leave the rate as it is; it only recovers while Experian answers successfully
+                return result
+            self.rate_limiter.on_throttled(result.get('retry_after'))
+        return {"error": "Experian is receiving too many requests right now. Please try again later."}
@@ -1,40 +1,96 @@
+import asyncio
+import datetime
+import email.utils
+import importlib.util
 import httpx
 import json
 import logging
+import time
+from credit_report import CreditReport, ReportSchemaError, parse_credit_report
+from metrics import track_upstream
 from config import (
-    get_secret,
-    SERVICE_EXPERIAN_API_BASE_URL,
-    SERVICE_EXPERIAN_CLIENT_ID,
-    SERVICE_EXPERIAN_CLIENT_SECRET,
-    SERVICE_EXPERIAN_USERNAME,
-    SERVICE_EXPERIAN_PASSWORD,
-    DEFAULT_EXPERIAN_API_BASE_URL
+    get_settings,
+    EXPERIAN_MAX_CONNECTIONS,
+    EXPERIAN_MAX_KEEPALIVE_CONNECTIONS,
+    EXPERIAN_KEEPALIVE_EXPIRY,
+    EXPERIAN_HTTP2,
+    EXPERIAN_CONNECT_TIMEOUT,
+    EXPERIAN_WRITE_TIMEOUT,
+    EXPERIAN_POOL_TIMEOUT,
+    EXPERIAN_TOKEN_READ_TIMEOUT,
+    EXPERIAN_REPORT_READ_TIMEOUT
 )
 
 logger = logging.getLogger(__name__)
 
+# HTTP errors after which a credit report request can safely be sent again
+RETRYABLE_STATUS_CODES = frozenset({502, 503, 504})
+# Network errors raised before the request was sent
+UNSENT_REQUEST_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# Application-wide HTTP client shared by all Experian calls (see create_http_client)
+_http_client: httpx.AsyncClient | None = None
+
+def _request_timeout(read_timeout: float) -> httpx.Timeout:
+    return httpx.Timeout(connect=EXPERIAN_CONNECT_TIMEOUT, read=read_timeout,
+                         write=EXPERIAN_WRITE_TIMEOUT, pool=EXPERIAN_POOL_TIMEOUT)
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Creates the long-lived Experian HTTP client with connection pooling and keep-alive,
+    and installs it as the client used by this module. Close it with close_http_client().
+    """
+    global _http_client
+    http2 = EXPERIAN_HTTP2
+    if http2 and importlib.util.find_spec('h2') is None:
+        logger.warning("EXPERIAN_HTTP2 is enabled but the 'h2' package is not installed; falling back to HTTP/1.1.")
+        http2 = False
+
+    limits = httpx.Limits(max_connections=EXPERIAN_MAX_CONNECTIONS,
+                          max_keepalive_connections=EXPERIAN_MAX_KEEPALIVE_CONNECTIONS,
+                          keepalive_expiry=EXPERIAN_KEEPALIVE_EXPIRY)
+    _http_client = httpx.AsyncClient(limits=limits, http2=http2,
+                                     timeout=_request_timeout(EXPERIAN_REPORT_READ_TIMEOUT))
+    logger.info("Created Experian HTTP client (max_connections=%s, http2=%s).", EXPERIAN_MAX_CONNECTIONS, http2)
+    return _http_client
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the shared Experian HTTP client, creating it on first use."""
+    if _http_client is None or _http_client.is_closed:
+        return create_http_client()
+    return _http_client
+
+async def close_http_client():
+    """Closes the shared Experian HTTP client and its pooled connections."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+        logger.info("Closed Experian HTTP client.")
+
+# Refresh the token this many seconds before Experian says it expires
+TOKEN_REFRESH_MARGIN = 60
+# Used when the token response does not include 'expires_in'
+DEFAULT_TOKEN_LIFETIME = 300
+
 async def get_experian_access_token():
     """
-    Retrieves Experian API credentials from keyring and gets an access token.
+    Gets an access token using the Experian API credentials from the settings snapshot.
+    Returns the decoded token response (containing 'access_token' and
+    usually 'expires_in'), or an {"error": ..., "transient": bool} dict on failure.
     """
-    # Retrieve credentials from keyring
-    experian_api_base_url = get_secret(SERVICE_EXPERIAN_API_BASE_URL) or DEFAULT_EXPERIAN_API_BASE_URL
-    experian_client_id = get_secret(SERVICE_EXPERIAN_CLIENT_ID)
-    experian_client_secret = get_secret(SERVICE_EXPERIAN_CLIENT_SECRET)
-    experian_username = get_secret(SERVICE_EXPERIAN_USERNAME)
-    experian_password = get_secret(SERVICE_EXPERIAN_PASSWORD)
-
-    if not all([experian_client_id, experian_client_secret, experian_username, experian_password]):
+    settings = get_settings()
+    if not settings.experian_credentials_configured:
         logger.error("Experian API credentials are not fully configured in keyring. Cannot get access token.")
-        return None
+        return {"error": "Experian API credentials are not configured.", "transient": False}
 
     # Example URL, check Experian docs for the correct authentication endpoint
-    auth_url = f"{experian_api_base_url}/oauth2/v1/token"
+    auth_url = f"{settings.experian_api_base_url}/oauth2/v1/token"
     payload = {
-        "username": experian_username,
-        "password": experian_password,
-        "client_id": experian_client_id,
-        "client_secret": experian_client_secret,
+        "username": settings.experian_username,
+        "password": settings.experian_password,
+        "client_id": settings.experian_client_id,
+        "client_secret": settings.experian_client_secret,
         "grant_type": "password" # Or client_credentials, depending on Experian's setup
     }
     headers = {
@@ -43,44 +99,132 @@ async def get_experian_access_token():
     }
 
     try:
-        async with httpx.AsyncClient() as http_client:
-            response = await http_client.post(auth_url, json=payload, headers=headers, timeout=10)
+        with track_upstream('oauth_token'):
+            response = await get_http_client().post(auth_url, json=payload, headers=headers,
+                                                    timeout=_request_timeout(EXPERIAN_TOKEN_READ_TIMEOUT))
             response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-            token_data = response.json()
-            return token_data.get('access_token')
+        token_data = response.json()
+        if not token_data.get('access_token'):
+            logger.error("Experian token response did not contain an access token.")
+            return {"error": "No access token in Experian token response.", "transient": False}
+        return token_data
+    except httpx.HTTPStatusError as e:
+        status_code = e.response.status_code
+        logger.error("Experian token endpoint returned HTTP %s.", status_code)
+        return {"error": f"Experian token endpoint returned HTTP {status_code}.", "transient": status_code >= 500}
     except httpx.RequestError as e:
-        logger.error(f"Error requesting Experian access token: {e}")
-        return None
+        logger.error("Error requesting Experian access token: %s", e)
+        return {"error": f"Network error requesting Experian access token: {e}", "transient": True}
     except json.JSONDecodeError:
-        logger.error(f"Failed to decode JSON from Experian token response: {response.text}") # type: ignore
-        return None
+        logger.error("Failed to decode JSON from Experian token response (%d bytes).", len(response.content)) # type: ignore
+        return {"error": "Invalid Experian token response.", "transient": False}
     except Exception as e:
-        logger.error(f"An unexpected error occurred during Experian token request: {e}")
+        logger.error("An unexpected error occurred during Experian token request: %s", e)
+        return {"error": f"An unexpected error occurred: {e}", "transient": False}
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parses a Retry-After header given in seconds or as an HTTP date. Returns seconds to wait."""
+    if not value:
         return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max((retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
 
-async def call_experian_credit_risk_api(customer_data: dict):
+class ExperianTokenManager:
     """
-    Placeholder function to call the Experian Credit Risk API.
-    This is where you'd send the collected customer_data.
+    Caches the Experian access token and refreshes it before it expires.
+    Concurrent callers share a single in-flight token request.
     """
-    logger.info(f"Attempting to call Experian API with data: {customer_data}")
+    def __init__(self, refresh_margin: float = TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._access_token = None
+        self._expires_at = 0.0
+        self._margin = refresh_margin # Margin for the current token, at most half its lifetime
+        self._lock = asyncio.Lock()
+        self._refresh_task = None
+        # Whether the last failed token request may succeed if retried (network error or 5xx)
+        self.last_failure_transient = False
 
-    access_token = await get_experian_access_token()
-    if not access_token:
-        return {"error": "Failed to authenticate with Experian API."}
+    def _is_fresh(self) -> bool:
+        return self._access_token is not None and time.monotonic() < self._expires_at - self._margin
 
-    # Retrieve base URL from keyring or use default
-    experian_api_base_url = get_secret(SERVICE_EXPERIAN_API_BASE_URL) or DEFAULT_EXPERIAN_API_BASE_URL
+    def _is_valid(self) -> bool:
+        return self._access_token is not None and time.monotonic() < self._expires_at
 
-    # Example endpoint for a consumer credit report (this is a placeholder)
-    # You MUST consult Experian's documentation for the correct endpoint and payload.
-    credit_report_url = f"{experian_api_base_url}/consumer/credit-report"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
+    async def get_token(self) -> str | None:
+        """Returns a valid access token, fetching a new one only when needed."""
+        if self._is_fresh():
+            return self._access_token
+        async with self._lock:
+            # Another coroutine may have refreshed the token while we waited
+            if self._is_fresh():
+                return self._access_token
+            token = await self._refresh()
+            if token is None and self._is_valid():
+                # The refresh failed, but the cached token has not expired yet
+                return self._access_token
+            return token
+
+    def invalidate(self):
+        """Drops the cached token, e.g. after the API rejected it with a 401."""
+        self._access_token = None
+        self._expires_at = 0.0
+
+    async def close(self):
+        """Cancels the background refresh task."""
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    async def _refresh(self) -> str | None:
+        token_data = await get_experian_access_token()
+        if 'error' in token_data:
+            # Keep any still-valid token; callers re-check freshness themselves
+            self.last_failure_transient = token_data['transient']
+            return None
+
+        try:
+            lifetime = float(token_data.get('expires_in') or DEFAULT_TOKEN_LIFETIME)
+        except (TypeError, ValueError):
+            lifetime = DEFAULT_TOKEN_LIFETIME
+        self._access_token = token_data['access_token']
+        self._expires_at = time.monotonic() + lifetime
+        # A short-lived token would otherwise never count as fresh and be fetched on every call
+        self._margin = min(self.refresh_margin, lifetime / 2)
+        logger.info("Obtained Experian access token valid for %.0fs.", lifetime)
+        self._schedule_refresh(lifetime)
+        return self._access_token
+
+    def _schedule_refresh(self, lifetime: float):
+        """Refreshes the token in the background just before the refresh margin is reached."""
+        if self._refresh_task and self._refresh_task is not asyncio.current_task():
+            self._refresh_task.cancel()
+        delay = max(lifetime - self._margin * 1.5, 0)
+        if delay <= 0:
+            # Token lifetime is too short to refresh ahead of time; refresh lazily instead
+            self._refresh_task = None
+            return
+        self._refresh_task = asyncio.create_task(self._background_refresh(delay))
+
+    async def _background_refresh(self, delay: float):
+        await asyncio.sleep(delay)
+        async with self._lock:
+            if await self._refresh() is None:
+                logger.warning("Background refresh of the Experian access token failed; will retry on next request.")
 
+# Shared token manager used by all Experian API calls
+token_manager = ExperianTokenManager()
+
+def build_experian_payload(customer_data: dict) -> dict:
+    """Maps the collected customer data to the Experian credit report request body."""
     # Construct the payload based on Experian's API documentation
     # This is a generic example; actual fields will vary.
     experian_payload = {
@@ -93,19 +237,74 @@ async def call_experian_credit_risk_api(customer_data: dict):
         "dateOfBirth": customer_data.get('dob'), # Format might be 'YYYY-MM-DD'
         "ssn": customer_data.get('ssn') # Handle SSN with extreme care and only if absolutely necessary and legally permissible
     }
+    return experian_payload
+
+async def call_experian_credit_risk_api(customer_data: dict) -> CreditReport | dict:
+    """
+    Placeholder function to call the Experian Credit Risk API.
+    This is where you'd send the collected customer_data.
+    Returns the parsed CreditReport, or an error dict.
+    """
+    logger.info("Attempting to call Experian API (SSN provided: %s).", bool(customer_data.get('ssn')))
+
+    access_token = await token_manager.get_token()
+    if not access_token:
+        # No report request was sent, so a retry cannot bill twice
+        transient = token_manager.last_failure_transient
+        return {"error": "Failed to authenticate with Experian API.", "transient": transient, "retryable": transient}
+
+    experian_api_base_url = get_settings().experian_api_base_url
+
+    # Example endpoint for a consumer credit report (this is a placeholder)
+    # You MUST consult Experian's documentation for the correct endpoint and payload.
+    credit_report_url = f"{experian_api_base_url}/consumer/credit-report"
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json",
+        "Accept": "application/json"
+    }
+
+    experian_payload = build_experian_payload(customer_data)
 
     try:
-        async with httpx.AsyncClient() as http_client:
-            response = await http_client.post(credit_report_url, json=experian_payload, headers=headers, timeout=30)
-            response.raise_for_status() # Raise an exception for HTTP errors
-            return response.json()
+        with track_upstream('credit_report'):
+            # The report is streamed and parsed as it arrives, keeping only the fields we use
+            async with get_http_client().stream('POST', credit_report_url, json=experian_payload, headers=headers,
+                                                timeout=_request_timeout(EXPERIAN_REPORT_READ_TIMEOUT)) as response:
+                if response.status_code == 401:
+                    # Token was revoked or expired early; drop it so the next call fetches a new one
+                    token_manager.invalidate()
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status() # Raise an exception for HTTP errors
+                return await parse_credit_report(response.aiter_bytes())
+    except httpx.HTTPStatusError as e:
+        status_code = e.response.status_code
+        logger.error("Experian Credit Risk API returned HTTP %s.", status_code)
+        error = {
+            "error": f"Experian API returned an error (HTTP {status_code}).",
+            "status_code": status_code,
+            "transient": status_code >= 500,
+            # Gateway errors mean the request never reached the report service, so it is safe to resend
+            "retryable": status_code in RETRYABLE_STATUS_CODES
+        }
+        retry_after = parse_retry_after(e.response.headers.get('Retry-After'))
+        if retry_after is not None:
+            error["retry_after"] = retry_after
+        return error
     except httpx.RequestError as e:
-        logger.error(f"Error calling Experian Credit Risk API: {e}")
-        return {"error": f"Network or API communication error: {e}"}
-    except json.JSONDecodeError:
-        logger.error(f"Failed to decode JSON from Experian Credit Risk response: {response.text}") # type: ignore
+        logger.error("Error calling Experian Credit Risk API: %s", e)
+        return {
+            "error": f"Network or API communication error: {e}",
+            "transient": True,
+            # Only resend if the request cannot have reached Experian, so a check is never billed twice
+            "retryable": isinstance(e, UNSENT_REQUEST_ERRORS)
+        }
+    except ReportSchemaError as e:
+        # The message names fields and types only, never report data
+        logger.error("Invalid Experian Credit Risk response: %s", e)
         return {"error": "Invalid response from Experian API."}
     except Exception as e:
-        logger.error(f"An unexpected error occurred during Experian API call: {e}")
+        logger.error("An unexpected error occurred during Experian API call: %s", e)
         return {"error": f"An unexpected error occurred: {e}"}
 
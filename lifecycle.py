@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import signal
+import time
+from contextlib import contextmanager
+from typing import Awaitable
+from config import SHUTDOWN_DRAIN_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# --- Lifecycle ---
+# Startup warm-up and graceful shutdown. On SIGTERM (or Ctrl+C) the bot stops
+# starting new credit checks and waits for the ones in flight to finish before
+# disconnecting, so a rolling restart does not drop anyone's check.
+
+class Lifecycle:
+    """
+    Tracks whether the bot is accepting new credit checks and how many are in flight.
+    A second shutdown signal skips the wait for in-flight checks.
+    """
+    def __init__(self, drain_timeout: float = SHUTDOWN_DRAIN_TIMEOUT):
+        self.drain_timeout = drain_timeout
+        self.accepting = True
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._shutdown_requested = asyncio.Event()
+        self._force = asyncio.Event()
+
+    @contextmanager
+    def track(self):
+        """Counts the enclosed block as an in-flight credit check."""
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.set()
+
+    def request_shutdown(self):
+        if self._shutdown_requested.is_set():
+            logger.warning("Second shutdown signal received; not waiting for in-flight credit checks.")
+            self._force.set()
+            return
+        logger.info("Shutdown requested; no longer accepting new credit checks.")
+        self.accepting = False
+        self._shutdown_requested.set()
+
+    async def wait_for_shutdown(self):
+        await self._shutdown_requested.wait()
+
+    def install_signal_handlers(self):
+        """Requests a graceful shutdown on SIGTERM and SIGINT, where the platform supports it."""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.request_shutdown)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+    async def drain(self, timeout: float | None = None) -> bool:
+        """Waits until no credit checks are in flight, for up to `timeout` seconds. Returns True if drained."""
+        timeout = self.drain_timeout if timeout is None else timeout
+        if self.in_flight:
+            logger.info("Waiting up to %.0fs for %d in-flight credit checks.", timeout, self.in_flight)
+        waiters = {asyncio.create_task(self._idle.wait()), asyncio.create_task(self._force.wait())}
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        if self.in_flight:
+            logger.warning("%d credit checks still in flight after draining.", self.in_flight)
+        return self.in_flight == 0
+
+    @staticmethod
+    async def warm_up(**steps: Awaitable):
+        """
+        Runs start-up work concurrently, e.g. fetching the Experian token while Telegram
+        logs in. Warm-up is best effort: failures are logged, not raised.
+        """
+        async def run(name: str, step: Awaitable):
+            started = time.perf_counter()
+            try:
+                await step
+                logger.info("Warm-up: %s ready in %.2fs.", name, time.perf_counter() - started)
+            except Exception as e:
+                logger.warning("Warm-up: %s failed: %s", name, e)
+        await asyncio.gather(*(run(name, step) for name, step in steps.items()))
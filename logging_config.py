@@ -0,0 +1,141 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+
+# --- Logging ---
+# Log records are put on an in-memory queue by the application and formatted,
+# redacted and written by a background listener thread, so the asyncio event
+# loop never blocks on log I/O.
+
+# Structured fields whose values must never reach the logs
+REDACTED_FIELDS = frozenset({
+    'ssn', 'dob', 'date_of_birth', 'dateofbirth', 'first_name', 'firstname', 'last_name', 'lastname',
+    'address', 'zip_code', 'zipcode', 'password', 'client_secret', 'access_token', 'authorization',
+    'customer_data', 'experian_payload',
+})
+REDACTED = '[REDACTED]'
+
+# Free-text patterns redacted from messages, in case PII ends up in an exception message.
+# Only the dashed SSN form is matched, so Telegram user ids and other 9-digit ids stay readable.
+_SSN_RE = re.compile(r'\b\d{3}-\d{2}-\d{4}\b')
+_BEARER_RE = re.compile(r'(?i)(bearer\s+)[\w.~+/-]+=*')
+
+# Attributes every LogRecord has; anything else was passed via `extra=`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_TRACEBACK_FORMATTER = logging.Formatter()
+
+def _redact_value(key: str, value):
+    if key.lower() in REDACTED_FIELDS:
+        return REDACTED
+    if isinstance(value, dict):
+        return {k: _redact_value(str(k), v) for k, v in value.items()}
+    if isinstance(value, str):
+        return _redact_text(value)
+    return value
+
+def _redact_text(text: str) -> str:
+    return _BEARER_RE.sub(r'\1' + REDACTED, _SSN_RE.sub(REDACTED, text))
+
+
+class RedactionFilter(logging.Filter):
+    """
+    Redacts PII from a record: sensitive `extra` fields and dict arguments are masked
+    by field name, and SSNs and bearer tokens are masked in the formatted message.
+    Installed on the listener's handlers, so it runs off the event loop.
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        try:
+            self._redact(record)
+        except Exception as e:
+            # E.g. a format string that does not match its arguments. An exception here would stop
+            # the listener thread, so keep the raw message, drop the arguments (they may hold PII)
+            # and the traceback, and carry on.
+            record.msg = _redact_text(f"{record.msg} [log record could not be formatted: {type(e).__name__}]")
+            record.args = None
+            record.exc_info = None
+            record.exc_text = None
+        return True
+
+    @staticmethod
+    def _redact(record: logging.LogRecord):
+        for key in set(vars(record)) - _RECORD_ATTRIBUTES:
+            setattr(record, key, _redact_value(key, getattr(record, key)))
+        if isinstance(record.args, dict):
+            record.args = _redact_value('', record.args)
+        elif record.args:
+            record.args = tuple(_redact_value('', arg) if isinstance(arg, dict) else arg for arg in record.args)
+        record.msg = _redact_text(record.getMessage())
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            # Formatters reuse exc_text, so the traceback is only rendered (and redacted) once
+            record.exc_text = _redact_text(_TRACEBACK_FORMATTER.formatException(record.exc_info))
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including any `extra` fields."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key in set(vars(record)) - _RECORD_ATTRIBUTES:
+            entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry['exc'] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records without formatting them. The standard QueueHandler merges the
+    message and arguments on the calling thread; here that work, like the
+    exception traceback formatting, is left to the listener thread.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_listener: logging.handlers.QueueListener | None = None
+
+def setup_logging(level: int | str = logging.INFO, fmt: str = 'text', stream=None):
+    """
+    Routes all logging through a queue to a background listener that redacts
+    and writes records as JSON (fmt='json') or in the classic text layout.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if fmt == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('[%(levelname) 5s/%(asctime)s] %(name)s: %(message)s'))
+    output.addFilter(RedactionFilter())
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+def stop_logging():
+    """Flushes queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
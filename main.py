@@ -1,25 +1,72 @@
 import asyncio
 import logging
+import signal
 from telethon import TelegramClient
 
 # Import configurations and modules
 from config import (
-    TELEGRAM_API_ID, TELEGRAM_API_HASH, TELEGRAM_BOT_TOKEN,
-    get_secret, SERVICE_TELEGRAM_API_ID, SERVICE_TELEGRAM_API_HASH, SERVICE_TELEGRAM_BOT_TOKEN
+    reload_settings_async, refresh_settings_periodically,
+    STATE_BACKEND, STATE_TTL, STATE_SQLITE_PATH, STATE_REDIS_URL,
+    METRICS_ENABLED, METRICS_HOST, METRICS_PORT, EXPERIAN_WORKER_PROCESSES
 )
+from dispatcher import ExperianDispatcher
+from experian_api import create_http_client, close_http_client, token_manager
+from lifecycle import Lifecycle
+import metrics
+from sender import TelegramSender
 from state_manager import StateManager
+from state_store import create_state_store
 from telegram_bot import TelegramBot
+from workers import WorkerPool
 
 logger = logging.getLogger(__name__)
 
+async def _apply_new_secrets(worker_pool: WorkerPool | None = None):
+    """Drops the Experian token so reloaded credentials take effect."""
+    token_manager.invalidate()
+    if worker_pool:
+        # Workers hold their own copy of the settings and their own token
+        await worker_pool.restart_workers()
+
+async def _reload_secrets(worker_pool: WorkerPool | None = None):
+    """Reloads the settings snapshot and applies the new credentials."""
+    await reload_settings_async()
+    await _apply_new_secrets(worker_pool)
+
+def _install_reload_handler(worker_pool: WorkerPool | None = None):
+    """Reloads secrets from keyring on SIGHUP, where the platform supports it."""
+    if not hasattr(signal, 'SIGHUP'):
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(_reload_secrets(worker_pool)))
+    except NotImplementedError:
+        pass
+
+def _install_worker_restart_handler(pool: WorkerPool):
+    """Restarts the Experian worker processes on SIGUSR2, without disconnecting the bot."""
+    if not hasattr(signal, 'SIGUSR2'):
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGUSR2, lambda: asyncio.ensure_future(pool.restart_workers()))
+    except NotImplementedError:
+        pass
+
+async def _warm_experian_token():
+    """Fetches the Experian token (opening a pooled connection) before the first credit check needs it."""
+    if not await token_manager.get_token():
+        raise RuntimeError("could not obtain an Experian access token")
+
 async def main():
     """
     Main function to initialize and run the Telegram bot.
     """
-    # Attempt to retrieve Telegram credentials from keyring first
-    telegram_api_id = get_secret(SERVICE_TELEGRAM_API_ID) or TELEGRAM_API_ID
-    telegram_api_hash = get_secret(SERVICE_TELEGRAM_API_HASH) or TELEGRAM_API_HASH
-    telegram_bot_token = get_secret(SERVICE_TELEGRAM_BOT_TOKEN) or TELEGRAM_BOT_TOKEN
+    # Load all secrets from keyring once (Telegram credentials fall back to environment variables)
+    settings = await reload_settings_async()
+    telegram_api_id = settings.telegram_api_id
+    telegram_api_hash = settings.telegram_api_hash
+    telegram_bot_token = settings.telegram_bot_token
 
     # Ensure at least one source (keyring or environment variable) provides credentials
     if not all([telegram_api_id, telegram_api_hash, telegram_bot_token]):
@@ -31,26 +78,89 @@ async def main():
     # 'bot_session' is the session name, change if you need multiple bot sessions
     client = TelegramClient('bot_session', telegram_api_id, telegram_api_hash)  # type: ignore
 
-    # Initialize State Manager
-    state_manager = StateManager()
+    # Shared, pooled HTTP client for all Experian API calls
+    create_http_client()
 
-    # Initialize Telegram Bot with the client and state manager
-    bot = TelegramBot(client, state_manager)
+    # Initialize State Manager with the configured storage backend
+    state_store = create_state_store(STATE_BACKEND, ttl=STATE_TTL, sqlite_path=STATE_SQLITE_PATH,
+                                     redis_url=STATE_REDIS_URL, encryption_key=settings.state_encryption_key)
+    state_manager = StateManager(state_store)
+    await state_manager.load_active_users()
+
+    # Bounded, rate-limited queue for Experian credit checks. In worker mode the checks
+    # themselves run in separate processes; queueing and rate limiting stay here.
+    worker_pool = None
+    if EXPERIAN_WORKER_PROCESSES > 0:
+        worker_pool = WorkerPool(EXPERIAN_WORKER_PROCESSES)
+        await worker_pool.start()
+        _install_worker_restart_handler(worker_pool)
+        dispatcher = ExperianDispatcher(call=worker_pool.call)
+    else:
+        dispatcher = ExperianDispatcher()
+
+    # Reload secrets on SIGHUP, and periodically if SETTINGS_TTL is set
+    # (restarting any worker processes so they pick them up)
+    _install_reload_handler(worker_pool)
+    settings_refresher = asyncio.create_task(
+        refresh_settings_periodically(on_change=lambda: _apply_new_secrets(worker_pool)))
+
+    # Shut down gracefully on SIGTERM/SIGINT, letting in-flight credit checks finish
+    lifecycle = Lifecycle()
+    lifecycle.install_signal_handlers()
+
+    # Outgoing messages are rate limited per chat and globally, and sent without blocking handlers
+    sender = TelegramSender()
+
+    # Initialize Telegram Bot with the client, state manager and dispatcher
+    bot = TelegramBot(client, state_manager, dispatcher, lifecycle=lifecycle, sender=sender)
+
+    # Expose metrics for scraping, if enabled; gauges are read at scrape time
+    metrics_server = None
+    if METRICS_ENABLED:
+        metrics.ACTIVE_CONVERSATIONS.set_function(lambda: state_manager.active_count)
+        metrics.QUEUE_LENGTH.set_function(lambda: dispatcher.queue_length)
+        metrics.CHECKS_IN_FLIGHT.set_function(lambda: dispatcher.in_flight)
+        metrics.TELEGRAM_SEND_QUEUE.set_function(lambda: sender.pending)
+        metrics_server = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
 
     # Start the Telegram client
     try:
         logger.info("Starting Telegram bot client...")
-        await client.start(bot_token=telegram_bot_token) # type: ignore
+        # Log in to Telegram while the Experian token is fetched (worker processes fetch their own)
+        warm_up = {}
+        if worker_pool is None and settings.experian_credentials_configured:
+            warm_up['experian_token'] = _warm_experian_token()
+        await asyncio.gather(client.start(bot_token=telegram_bot_token), lifecycle.warm_up(**warm_up)) # type: ignore
         logger.info("Telegram bot client started successfully.")
         print("Bot is running. Send /start to your bot.")
-        await client.run_until_disconnected() # type: ignore
+        running = asyncio.ensure_future(client.run_until_disconnected()) # type: ignore
+        shutdown = asyncio.ensure_future(lifecycle.wait_for_shutdown())
+        await asyncio.wait({running, shutdown}, return_when=asyncio.FIRST_COMPLETED)
+        shutdown.cancel()
     except Exception as e:
-        logger.critical(f"An error occurred while starting or running the bot: {e}")
+        logger.critical("An error occurred while starting or running the bot: %s", e)
         print(f"An error occurred: {e}")
     finally:
+        # Stop taking new checks and let the ones in flight finish while Telegram is still connected
+        lifecycle.accepting = False
+        if client.is_connected():
+            await lifecycle.drain()
+        await dispatcher.stop() # Checks still queued are answered with a "shutting down" error
         if client.is_connected():
+            await lifecycle.drain(timeout=5)
+            await sender.drain(timeout=10) # Deliver the replies still queued
             logger.info("Disconnecting Telegram client.")
             await client.disconnect() # type: ignore
+        await sender.close()
+        settings_refresher.cancel()
+        if metrics_server:
+            metrics_server.close()
+            await metrics_server.wait_closed()
+        if worker_pool:
+            await worker_pool.stop()
+        await state_manager.close() # Flushes pending state writes
+        await token_manager.close()
+        await close_http_client()
 
 if __name__ == '__main__':
     try:
@@ -59,5 +169,5 @@ if __name__ == '__main__':
         logger.info("Bot stopped by user (KeyboardInterrupt).")
         print("Bot stopped by user.")
     except Exception as e:
-        logger.critical(f"An unhandled error occurred in main execution: {e}")
+        logger.critical("An unhandled error occurred in main execution: %s", e)
         print(f"An unhandled error occurred: {e}")
\ No newline at end of file
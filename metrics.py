@@ -0,0 +1,238 @@
+import asyncio
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# --- Metrics ---
+# A small Prometheus-compatible metrics layer. Recording is a no-op until
+# enable() is called, so instrumented hot paths cost one attribute check
+# when metrics are turned off.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Registry:
+    def __init__(self):
+        self.enabled = False
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Renders all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+def enable():
+    REGISTRY.enabled = True
+
+def is_enabled() -> bool:
+    return REGISTRY.enabled
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), registry: Registry = REGISTRY):
+        self.name, self.help, self.labels = name, help, labels
+        self._registry = registry
+        self._values: dict[tuple, float] = {}
+        registry.register(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        if self._registry.enabled:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), registry: Registry = REGISTRY):
+        self.name, self.help, self.labels = name, help, labels
+        self._registry = registry
+        self._values: dict[tuple, float] = {}
+        self._functions: dict[tuple, Callable[[], float]] = {}
+        registry.register(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        if self._registry.enabled:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value: float, *label_values):
+        if self._registry.enabled:
+            self._values[label_values] = value
+
+    def set_function(self, func: Callable[[], float], *label_values):
+        """Reads the value from `func` at scrape time instead of tracking it on the hot path."""
+        self._functions[label_values] = func
+
+    def samples(self):
+        values = dict(self._values)
+        for label_values, func in self._functions.items():
+            try:
+                values[label_values] = func()
+            except Exception as e:
+                logger.warning("Failed to read gauge %s: %s", self.name, e)
+        for label_values, value in values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY):
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = tuple(sorted(buckets))
+        self._registry = registry
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._values: dict[tuple, list[float]] = {}
+        registry.register(self)
+
+    def observe(self, value: float, *label_values):
+        if not self._registry.enabled:
+            return
+        series = self._values.get(label_values)
+        if series is None:
+            series = self._values[label_values] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Times the enclosed block."""
+        if not self._registry.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def samples(self):
+        for label_values, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, label_values)} {series[-1]}"
+            yield f"{self.name}_count{_format_labels(self.labels, label_values)} {cumulative}"
+
+
+# --- Application Metrics ---
+
+HANDLER_LATENCY = Histogram('experianbot_handler_seconds', "Time spent in Telegram event handlers.", ('handler',))
+HANDLER_ERRORS = Counter('experianbot_handler_errors_total', "Unhandled exceptions in Telegram event handlers.", ('handler',))
+UPSTREAM_LATENCY = Histogram('experianbot_upstream_seconds',
+                             "Latency of upstream calls by phase (keyring, oauth_token, credit_report, telegram_send).",
+                             ('phase',))
+UPSTREAM_IN_FLIGHT = Gauge('experianbot_upstream_in_flight', "Upstream calls currently in progress.", ('phase',))
+UPSTREAM_ERRORS = Counter('experianbot_upstream_errors_total', "Failed upstream calls by phase and kind.", ('phase', 'kind'))
+ACTIVE_CONVERSATIONS = Gauge('experianbot_active_conversations', "Conversations currently in progress.")
+QUEUE_LENGTH = Gauge('experianbot_experian_queue_length', "Credit checks waiting for a dispatcher worker.")
+CHECKS_IN_FLIGHT = Gauge('experianbot_experian_checks_in_flight', "Credit checks being processed by dispatcher workers.")
+TELEGRAM_SEND_QUEUE = Gauge('experianbot_telegram_send_queue', "Outgoing Telegram messages waiting to be sent.")
+CACHE_LOOKUPS = Counter('experianbot_result_cache_lookups_total', "Result cache lookups.", ('result',))
+
+@contextmanager
+def track_upstream(phase: str):
+    """Times an upstream call and counts it as in flight while it runs."""
+    if not REGISTRY.enabled:
+        yield
+        return
+    UPSTREAM_IN_FLIGHT.inc(phase)
+    started = time.perf_counter()
+    try:
+        yield
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+        UPSTREAM_ERRORS.inc(phase, 'timeout')
+        raise
+    except Exception as e:
+        UPSTREAM_ERRORS.inc(phase, type(e).__name__)
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, phase)
+        UPSTREAM_IN_FLIGHT.dec(phase)
+
+def timed_handler(handler):
+    """Decorator recording latency and unhandled errors of an async Telegram handler."""
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        if not REGISTRY.enabled:
+            return await handler(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+# --- Scrape Endpoint ---
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass # Skip request headers
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', REGISTRY.render().encode()
+        else:
+            status, body = '404 Not Found', b'Not Found\n'
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server(host: str, port: int) -> asyncio.AbstractServer:
+    """Enables metrics and serves them at http://host:port/metrics."""
+    enable()
+    server = await asyncio.start_server(_handle_scrape, host, port)
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics", host, port)
+    return server
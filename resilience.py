@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable
+from config import (
+    EXPERIAN_RETRY_ATTEMPTS,
+    EXPERIAN_RETRY_BASE_DELAY,
+    EXPERIAN_RETRY_MAX_DELAY,
+    EXPERIAN_HEDGE_ENABLED,
+    EXPERIAN_BREAKER_FAILURE_THRESHOLD,
+    EXPERIAN_BREAKER_RESET_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Resilience ---
+# Retries, hedging and a circuit breaker for upstream calls that return the
+# {"error": ..., "transient": bool, "retryable": bool} dicts used by experian_api.
+
+def is_error(result) -> bool:
+    return isinstance(result, dict) and bool(result.get('error'))
+
+def is_upstream_failure(result) -> bool:
+    """True for failures that indicate the upstream is unhealthy (network errors, 5xx)."""
+    return is_error(result) and bool(result.get('transient'))
+
+
+class RetryPolicy:
+    """Retries with "decorrelated jitter" backoff: each delay is random between base and 3x the previous delay."""
+    def __init__(self, attempts: int = EXPERIAN_RETRY_ATTEMPTS, base_delay: float = EXPERIAN_RETRY_BASE_DELAY,
+                 max_delay: float = EXPERIAN_RETRY_MAX_DELAY):
+        self.attempts = max(attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delays(self):
+        """Yields the delay before each retry."""
+        delay = self.base_delay
+        for _ in range(self.attempts - 1):
+            delay = min(self.max_delay, random.uniform(self.base_delay, delay * 3))
+            yield delay
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the upstream is down. Opens after `failure_threshold` consecutive
+    failures; after `reset_timeout` seconds a single half-open probe is let through,
+    and its outcome closes the circuit or opens it again.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold: int = EXPERIAN_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = EXPERIAN_BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            logger.info("Circuit breaker half-open; probing upstream.")
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Circuit breaker closed; upstream has recovered.")
+        self.state = self.CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """Allows a new half-open probe when the current one ended without an outcome."""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning("Circuit breaker opened after %s consecutive failures.", self._failures)
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Keeps a window of recent call latencies to estimate percentiles."""
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self._samples: deque[float] = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> float | None:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+class ResilientCaller:
+    """
+    Wraps an upstream call with a circuit breaker, retries for failures that are
+    safe to resend and, optionally, a hedged second request once the first is
+    slower than the recent p95 latency.
+    """
+    def __init__(self, call: Callable[[dict], Awaitable[dict]], retry_policy: RetryPolicy | None = None,
+                 breaker: CircuitBreaker | None = None, hedge: bool = EXPERIAN_HEDGE_ENABLED):
+        self.call = call
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = hedge
+        self.latency = LatencyTracker()
+
+    async def __call__(self, customer_data: dict) -> dict:
+        delays = self.retry_policy.delays()
+        while True:
+            if not self.breaker.allow_request():
+                return {"error": "Experian is temporarily unavailable. Please try again in a few minutes.",
+                        "transient": True, "retryable": False}
+
+            try:
+                result = await self._attempt(customer_data)
+            except BaseException:
+                # E.g. cancellation on shutdown: not an upstream failure, but never leave a probe outstanding
+                self.breaker.release_probe()
+                raise
+            if is_upstream_failure(result):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+            if not (is_error(result) and result.get('retryable')):
+                return result
+            delay = next(delays, None)
+            if delay is None:
+                return result
+            logger.info("Retrying Experian call in %.2fs after a retryable failure.", delay)
+            await asyncio.sleep(delay)
+
+    async def _timed_call(self, customer_data: dict) -> dict:
+        started = time.monotonic()
+        result = await self.call(customer_data)
+        if not is_error(result):
+            self.latency.record(time.monotonic() - started)
+        return result
+
+    async def _attempt(self, customer_data: dict) -> dict:
+        hedge_delay = self.latency.percentile(95) if self.hedge else None
+        if hedge_delay is None:
+            return await self._timed_call(customer_data)
+
+        primary = asyncio.create_task(self._timed_call(customer_data))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+            if done:
+                return primary.result()
+
+            logger.info("Experian call slower than p95 (%.2fs); sending a hedged request.", hedge_delay)
+            pending.add(asyncio.create_task(self._timed_call(customer_data)))
+            result = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if not is_error(result):
+                        return result
+            return result # type: ignore
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import re
+import secrets
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+from config import EXPERIAN_CACHE_TTL, EXPERIAN_CACHE_MAX_ENTRIES
+from credit_report import CreditReport
+from dispatcher import PositionCallback
+from experian_api import build_experian_payload
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# --- Result Cache ---
+# Short-lived cache of successful credit checks, so a user re-running
+# /check_credit with the same details gets the same answer without another
+# billed Experian call. Entries are keyed by a salted HMAC of the request,
+# so no customer data is kept as a key. Only the parsed CreditReport fields
+# the bot shows are cached, never the customer data or the raw report.
+
+_WHITESPACE = re.compile(r'\s+')
+
+def _normalize(field: str, value) -> str:
+    if value is None:
+        return ''
+    text = _WHITESPACE.sub(' ', str(value)).strip().casefold()
+    if field in ('ssn', 'zipCode'):
+        # "123-45-6789" and "123 45 6789" are the same SSN
+        text = re.sub(r'[^0-9a-z]', '', text)
+    return text
+
+
+class _InFlight:
+    """A credit check in progress and the queue-position callbacks of everyone waiting for it."""
+    def __init__(self):
+        self.future: asyncio.Future | None = None
+        self.listeners: list[PositionCallback] = []
+        self.last_position: int | None = None
+
+    async def notify(self, position: int):
+        """Passed to the shared call as its `on_position`, so every waiter sees the queue position."""
+        self.last_position = position
+        await asyncio.gather(*(listener(position) for listener in list(self.listeners)))
+
+    async def wait(self, on_position: PositionCallback | None):
+        if on_position is not None:
+            self.listeners.append(on_position)
+            if self.last_position is not None:
+                # Joined after the first update; tell this waiter where the shared check is now
+                try:
+                    await on_position(self.last_position)
+                except Exception as e:
+                    logger.warning("Failed to send queue position update: %s", e)
+        try:
+            # shield() so one cancelled waiter does not cancel the shared call for everyone else
+            return await asyncio.shield(self.future) # type: ignore
+        finally:
+            if on_position is not None:
+                self.listeners.remove(on_position)
+
+
+class ResultCache:
+    """
+    LRU + TTL cache for successful Experian results, with a size cap.
+    Concurrent lookups for the same request share a single upstream call.
+    """
+    def __init__(self, ttl: float = EXPERIAN_CACHE_TTL, max_entries: int = EXPERIAN_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # The salt lives only in this process's memory, so keys cannot be reversed by guessing inputs offline
+        self._salt = secrets.token_bytes(32)
+        self._entries: OrderedDict[bytes, tuple[float, object]] = OrderedDict()
+        self._in_flight: dict[bytes, _InFlight] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def key(self, customer_data: dict) -> bytes:
+        """Returns the salted hash identifying a credit check request."""
+        payload = build_experian_payload(customer_data)
+        canonical = json.dumps({field: _normalize(field, value) for field, value in payload.items()},
+                               sort_keys=True, separators=(',', ':'))
+        return hmac.new(self._salt, canonical.encode('utf-8'), hashlib.sha256).digest()
+
+    def _get(self, key: bytes):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _put(self, key: bytes, result):
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def fetch(self, customer_data: dict, compute: Callable[[PositionCallback | None], Awaitable[dict]],
+                    on_position: PositionCallback | None = None) -> dict:
+        """
+        Returns the cached result for this request, joins an identical request already
+        in flight, or runs `compute(on_position)` and caches the result if it succeeded.
+        Queue positions reported by the shared call reach the `on_position` of every waiter.
+        """
+        if not self.enabled:
+            return await compute(on_position)
+
+        key = self.key(customer_data)
+        cached = self._get(key)
+        if cached is not None:
+            self.hits += 1
+            CACHE_LOOKUPS.inc('hit')
+            logger.info("Serving credit check from the result cache.")
+            return cached # type: ignore
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.hits += 1
+            CACHE_LOOKUPS.inc('coalesced')
+            return await in_flight.wait(on_position)
+
+        self.misses += 1
+        CACHE_LOOKUPS.inc('miss')
+        in_flight = self._in_flight[key] = _InFlight()
+        in_flight.future = asyncio.ensure_future(compute(in_flight.notify))
+
+        def finished(done: asyncio.Future):
+            # Runs even if every waiter was cancelled, so a completed call is still cached
+            if self._in_flight.get(key) is in_flight:
+                del self._in_flight[key]
+            if done.cancelled() or done.exception() is not None:
+                return
+            result = done.result()
+            if isinstance(result, CreditReport): # Errors are not cached
+                self._put(key, result)
+
+        in_flight.future.add_done_callback(finished)
+        return await in_flight.wait(on_position)
+
+    def clear(self):
+        self._entries.clear()
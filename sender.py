@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from telethon.errors import FloodWaitError
+from config import TELEGRAM_GLOBAL_RATE_LIMIT, TELEGRAM_CHAT_RATE_LIMIT, TELEGRAM_CHAT_BURST
+from dispatcher import AdaptiveRateLimiter
+from metrics import track_upstream
+
+logger = logging.getLogger(__name__)
+
+# --- Outbound Telegram Messages ---
+# Handlers queue their replies here instead of sending them directly. Each chat
+# has its own queue, drained in order under a per-chat and a global rate limit.
+# Replies that pile up for a chat while it waits for its rate limit are merged
+# into one message. A FloodWaitError pauses the affected chat and lowers the global rate.
+
+TELEGRAM_MESSAGE_LIMIT = 4096 # Maximum characters in one message
+MESSAGE_SEPARATOR = "\n\n"
+
+@dataclass
+class _Outgoing:
+    event: object # Event to reply to (or, for edits, whose message is edited)
+    text: str
+    buttons: object = None
+    edit: bool = False
+    futures: list[asyncio.Future] = field(default_factory=list)
+    attempts: int = 0
+
+    def can_merge(self, other: '_Outgoing') -> bool:
+        # Buttons belong under the last message, so only a message without buttons can take on more text
+        return (not self.edit and not other.edit and self.buttons is None
+                and len(self.text) + len(MESSAGE_SEPARATOR) + len(other.text) <= TELEGRAM_MESSAGE_LIMIT)
+
+    def merge(self, other: '_Outgoing'):
+        self.text = self.text + MESSAGE_SEPARATOR + other.text
+        self.buttons = other.buttons
+        self.futures.extend(other.futures)
+
+
+class _ChatQueue:
+    """Pending messages for one chat, with a token bucket for the per-chat limit."""
+    def __init__(self, burst: int):
+        self.pending: deque[_Outgoing] = deque()
+        self.wakeup = asyncio.Event()
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+
+class TelegramSender:
+    """
+    Schedules outgoing messages and edits without blocking the handlers that queue them.
+    `send` and `edit` return a future resolved with the sent message, or None if sending failed.
+    """
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE_LIMIT, chat_rate: float = TELEGRAM_CHAT_RATE_LIMIT,
+                 chat_burst: int = TELEGRAM_CHAT_BURST, max_flood_retries: int = 3):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_flood_retries = max_flood_retries
+        # A flood wait also halves the global rate; it recovers in about 10 successful sends,
+        # so occasional per-chat flood waits do not hold back everyone else for long
+        self.global_limiter = AdaptiveRateLimiter(global_rate, recovery=global_rate / 20, name='Telegram')
+        self._chats: dict[int, _ChatQueue] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def pending(self) -> int:
+        """Messages queued or being sent."""
+        return self._pending
+
+    def send(self, event, text: str, buttons=None) -> asyncio.Future:
+        """Queues a message to the event's chat."""
+        return self._enqueue(event, _Outgoing(event, text, buttons))
+
+    def edit(self, event, text: str, buttons=None) -> asyncio.Future:
+        """Queues an edit of the message the event came from (e.g. the one with the clicked button)."""
+        return self._enqueue(event, _Outgoing(event, text, buttons, edit=True))
+
+    def _enqueue(self, event, item: _Outgoing) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        item.futures.append(future)
+        chat_id = event.chat_id
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatQueue(self.chat_burst)
+        chat.pending.append(item)
+        chat.wakeup.set()
+        self._pending += 1
+        self._idle.clear()
+        if chat_id not in self._tasks:
+            self._tasks[chat_id] = asyncio.create_task(self._run_chat(chat_id, chat))
+        return future
+
+    async def drain(self, timeout: float | None = None) -> bool:
+        """Waits until every queued message has been sent. Returns False if `timeout` ran out first."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning("%d outgoing Telegram messages were not sent before the timeout.", self._pending)
+            return False
+
+    async def close(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def _done(self, item: _Outgoing, result, count: int):
+        for future in item.futures:
+            if not future.done():
+                future.set_result(result)
+        self._pending -= count
+        if self._pending == 0:
+            self._idle.set()
+
+    async def _run_chat(self, chat_id: int, chat: _ChatQueue):
+        try:
+            while True:
+                now = time.monotonic()
+                chat.tokens = min(self.chat_burst, chat.tokens + (now - chat.updated) * self.chat_rate)
+                chat.updated = now
+
+                if not chat.pending:
+                    # Stay until the bucket has refilled, so the limit holds across bursts; then forget the chat
+                    refill = (self.chat_burst - chat.tokens) / self.chat_rate
+                    if refill <= 0:
+                        return
+                    chat.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(chat.wakeup.wait(), refill)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                wait = max(chat.paused_until - now, (1 - chat.tokens) / self.chat_rate)
+                if wait > 0:
+                    # Messages queued meanwhile are merged into this one below
+                    await asyncio.sleep(wait)
+                    continue
+
+                await self.global_limiter.acquire()
+                item = chat.pending.popleft()
+                count = 1
+                while chat.pending and item.can_merge(chat.pending[0]):
+                    item.merge(chat.pending.popleft())
+                    count += 1
+                chat.tokens -= 1
+                await self._deliver(chat, item, count)
+        finally:
+            if self._tasks.get(chat_id) is asyncio.current_task():
+                del self._tasks[chat_id]
+                del self._chats[chat_id]
+            # Anything left (e.g. on shutdown) is answered so no caller waits forever
+            while chat.pending:
+                self._done(chat.pending.popleft(), None, 1)
+
+    async def _deliver(self, chat: _ChatQueue, item: _Outgoing, count: int):
+        try:
+            with track_upstream('telegram_send'):
+                if item.edit:
+                    message = await item.event.edit(item.text, buttons=item.buttons) # type: ignore
+                else:
+                    message = await item.event.respond(item.text, buttons=item.buttons) # type: ignore
+        except asyncio.CancelledError:
+            # Cancelled mid-send (e.g. on shutdown): answer the callers and stop counting the message
+            self._done(item, None, count)
+            raise
+        except FloodWaitError as e:
+            self.global_limiter.on_throttled(None)
+            item.attempts += 1
+            if item.attempts > self.max_flood_retries:
+                logger.error("Dropping Telegram message after %d flood waits.", item.attempts - 1)
+                self._done(item, None, count)
+                return
+            # Pause this chat and retry the message first; other chats keep going at the lowered rate
+            chat.paused_until = time.monotonic() + e.seconds
+            chat.pending.appendleft(item)
+            self._pending -= count - 1 # Counted again as a single message from now on
+            logger.warning("Telegram flood wait of %ss; rescheduling the message.", e.seconds)
+            return
+        except Exception as e:
+            logger.error("Failed to send Telegram message: %s", e)
+            self._done(item, None, count)
+            return
+        self.global_limiter.on_success()
+        self._done(item, message, count)
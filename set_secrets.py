@@ -9,8 +9,10 @@ import os
 from config import (
     SERVICE_TELEGRAM_API_ID, SERVICE_TELEGRAM_API_HASH, SERVICE_TELEGRAM_BOT_TOKEN,
     SERVICE_EXPERIAN_API_BASE_URL, SERVICE_EXPERIAN_CLIENT_ID,
-    SERVICE_EXPERIAN_CLIENT_SECRET, SERVICE_EXPERIAN_USERNAME, SERVICE_EXPERIAN_PASSWORD
+    SERVICE_EXPERIAN_CLIENT_SECRET, SERVICE_EXPERIAN_USERNAME, SERVICE_EXPERIAN_PASSWORD,
+    SERVICE_STATE_ENCRYPTION_KEY
 )
+from state_store import StateCipher
 
 # Load environment variables from .env file
 load_dotenv()
@@ -26,6 +28,9 @@ EXPERIAN_CLIENT_SECRET = os.getenv('EXPERIAN_CLIENT_SECRET')
 EXPERIAN_USERNAME = os.getenv('EXPERIAN_USERNAME')
 EXPERIAN_PASSWORD = os.getenv('EXPERIAN_PASSWORD')
 
+STATE_ENCRYPTION_KEY = os.getenv('STATE_ENCRYPTION_KEY')
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory').lower()
+
 # Set Telegram secrets
 keyring.set_password(SERVICE_TELEGRAM_API_ID, 'default_user', TELEGRAM_API_ID) # type: ignore
 keyring.set_password(SERVICE_TELEGRAM_API_HASH, 'default_user', TELEGRAM_API_HASH) # type: ignore
@@ -38,5 +43,13 @@ keyring.set_password(SERVICE_EXPERIAN_CLIENT_SECRET, 'default_user', EXPERIAN_CL
 keyring.set_password(SERVICE_EXPERIAN_USERNAME, 'default_user', EXPERIAN_USERNAME) # type: ignore
 keyring.set_password(SERVICE_EXPERIAN_PASSWORD, 'default_user', EXPERIAN_PASSWORD) # type: ignore
 
+# Key for conversation state stored by the sqlite/redis backends. Generated once if not given
+# and one of those backends is selected; keep an existing key, or state written with it can
+# no longer be read.
+if STATE_ENCRYPTION_KEY:
+    keyring.set_password(SERVICE_STATE_ENCRYPTION_KEY, 'default_user', STATE_ENCRYPTION_KEY)
+elif STATE_BACKEND in ('sqlite', 'redis') and not keyring.get_password(SERVICE_STATE_ENCRYPTION_KEY, 'default_user'):
+    keyring.set_password(SERVICE_STATE_ENCRYPTION_KEY, 'default_user', StateCipher.generate_key())
+
 print("Secrets have been stored in your system's keyring.")
 print("You can now run main.py without setting these as environment variables.")
\ No newline at end of file
@@ -1,36 +1,174 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from conversation_state import ConversationState, Step, INITIAL_STATE
+from state_store import StateStore, MemoryStateStore
+
 # --- State Management ---
-# In a real application, you might use a database (e.g., Firestore) to store
-# conversation state for persistence across bot restarts or for more complex flows.
+# Conversation state is kept in a pluggable StateStore (see state_store.py), so it
+# can live in memory, in SQLite or in Redis and survive bot restarts.
+
+class StateEdit:
+    """A user's state read under their lock; `save` and `delete` write it back."""
+    __slots__ = ('_manager', 'user_id', 'state')
+
+    def __init__(self, manager: 'StateManager', user_id: int, state: ConversationState | None):
+        self._manager = manager
+        self.user_id = user_id
+        self.state = state
+
+    async def save(self, state: ConversationState):
+        await self._manager.store.set(self.user_id, state)
+        self._manager._track(self.user_id, state)
+        self.state = state
+
+    async def delete(self):
+        await self._manager.store.delete(self.user_id)
+        self._manager._track(self.user_id, None)
+        self.state = None
+
 
 class StateManager:
     """
     Manages the conversation state for each user.
-    Currently uses an in-memory dictionary.
+    Uses an in-memory store unless another StateStore is provided.
     """
-    def __init__(self):
-        self.user_states = {} # {user_id: {'step': 'initial', 'data': {}}}
+    def __init__(self, store: StateStore | None = None, lock_shards: int = 64):
+        self.store = store if store is not None else MemoryStateStore() # {user_id: ConversationState}
+        # Read-modify-write updates span awaits on persistent stores, so updates for
+        # the same user are serialised by one of a fixed set of sharded locks
+        self._locks = [asyncio.Lock() for _ in range(lock_shards)]
+        # The memory store can be asked directly. For other stores, users with a conversation
+        # in progress are tracked here, mapped to when their state expires and ordered by
+        # last write so expired entries can be dropped from the front.
+        self._memory = self.store if isinstance(self.store, MemoryStateStore) else None
+        self._active_users: OrderedDict[int, float] | None = None if self._memory is not None else OrderedDict()
+
+    def _lock(self, user_id: int) -> asyncio.Lock:
+        return self._locks[user_id % len(self._locks)]
+
+    def _track(self, user_id: int, state: ConversationState | None):
+        """Keeps the active-user set in sync with a state that was just written."""
+        if self._active_users is None:
+            return
+        if state is None or state.step == Step.INITIAL:
+            self._active_users.pop(user_id, None)
+            return
+        now = time.monotonic()
+        self._active_users[user_id] = now + self.store.ttl
+        self._active_users.move_to_end(user_id)
+        while self._active_users:
+            oldest, expires_at = next(iter(self._active_users.items()))
+            if expires_at > now:
+                break
+            del self._active_users[oldest]
+
+    def is_active(self, user_id: int) -> bool:
+        """
+        Returns True if the user has a conversation in progress that this process knows about.
+        This is an in-memory check meant for event filters; it never awaits the store.
+        """
+        if self._memory is not None:
+            state = self._memory.peek(user_id)
+            return state is not None and state.step != Step.INITIAL
+        expires_at = self._active_users.get(user_id)
+        if expires_at is None:
+            return False
+        if expires_at <= time.monotonic():
+            del self._active_users[user_id]
+            return False
+        return True
+
+    async def has_active_flow(self, user_id: int) -> bool:
+        """Checks the store itself for a conversation in progress, e.g. one started by another process."""
+        if self.is_active(user_id):
+            return True
+        state = await self.store.get(user_id)
+        self._track(user_id, state)
+        return state is not None and state.step != Step.INITIAL
 
-    def get_state(self, user_id: int) -> dict:
+    async def load_active_users(self):
+        """Seeds the active-user set from the store, so conversations survive a restart."""
+        for user_id in await self.store.active_user_ids():
+            self._track(user_id, await self.store.get(user_id))
+
+    @asynccontextmanager
+    async def edit(self, user_id: int) -> AsyncIterator[StateEdit]:
+        """
+        Holds the user's lock for one read-modify-write: the state is read once on entry
+        and only written if `save` or `delete` is called. Other updates for the user wait,
+        so keep slow work (such as the Experian call) outside the block.
+        """
+        async with self._lock(user_id):
+            yield StateEdit(self, user_id, await self.store.get(user_id))
+
+    async def get_state(self, user_id: int) -> ConversationState:
         """Retrieves the current state for a given user."""
-        return self.user_states.get(user_id, {'step': 'initial', 'data': {}})
+        return await self.store.get(user_id) or INITIAL_STATE
 
-    def set_state(self, user_id: int, step: str, data: dict = None): # type: ignore
+    async def set_state(self, user_id: int, step: Step | str, data: dict = None): # type: ignore
         """Sets or updates the state for a given user."""
-        if user_id not in self.user_states:
-            self.user_states[user_id] = {'step': step, 'data': {}}
-        else:
-            self.user_states[user_id]['step'] = step
-            if data:
-                self.user_states[user_id]['data'].update(data)
-            
-    def update_data(self, user_id: int, key: str, value: any): # type: ignore
+        async with self._lock(user_id):
+            state = await self.store.get(user_id)
+            if state is None:
+                state = INITIAL_STATE.with_step(step)
+            else:
+                state = state.with_step(step)
+                if data:
+                    state = state.with_data(**data)
+            await self.store.set(user_id, state)
+            self._track(user_id, state)
+
+    async def update_data(self, user_id: int, key: str, value: any): # type: ignore
         """Updates a specific piece of data within the user's current state."""
-        if user_id in self.user_states:
-            self.user_states[user_id]['data'][key] = value
-        else:
-            # Initialize state if it doesn't exist
-            self.user_states[user_id] = {'step': 'initial', 'data': {key: value}}
+        async with self._lock(user_id):
+            state = (await self.store.get(user_id) or INITIAL_STATE).with_data(**{key: value})
+            await self.store.set(user_id, state)
+            self._track(user_id, state)
 
-    def clear_state(self, user_id: int):
+    async def transition(self, user_id: int, from_step: Step, to_step: Step, data: dict = None) -> ConversationState | None: # type: ignore
+        """
+        Atomically moves a user from `from_step` to `to_step`, storing `data` in the same write.
+        Returns the new state, or None if the user was no longer at `from_step`
+        (e.g. a duplicate message or button press was already handled).
+        """
+        async with self.edit(user_id) as edit:
+            state = edit.state or INITIAL_STATE
+            if state.step != from_step:
+                return None
+            state = state.with_step(to_step)
+            if data:
+                state = state.with_data(**data)
+            await edit.save(state)
+            return state
+
+    async def complete(self, user_id: int, from_step: Step) -> ConversationState | None:
+        """
+        Atomically ends the flow for a user at `from_step`, returning their final state,
+        or None if the user was no longer at that step.
+        """
+        async with self.edit(user_id) as edit:
+            state = edit.state
+            if state is None or state.step != from_step:
+                return None
+            await edit.delete()
+            return state
+
+    async def clear_state(self, user_id: int):
         """Clears the state for a given user."""
-        self.user_states.pop(user_id, None)
+        async with self._lock(user_id):
+            await self.store.delete(user_id)
+            self._track(user_id, None)
+
+    @property
+    def active_count(self) -> int:
+        """Number of conversations in progress known to this process."""
+        if self._memory is not None:
+            return self._memory.in_progress_count
+        return len(self._active_users) # type: ignore
+
+    async def close(self):
+        """Flushes and closes the underlying store."""
+        await self.store.close()
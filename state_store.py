@@ -0,0 +1,346 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from conversation_state import ConversationState, Step
+
+logger = logging.getLogger(__name__)
+
+# --- State Stores ---
+# Backends that hold conversation state for StateManager. Each entry expires
+# `ttl` seconds after it was last written, so abandoned conversations are evicted.
+# Persistent backends encrypt every state with StateCipher before it is written.
+
+DEFAULT_STATE_TTL = 3600
+
+class StateCipher:
+    """
+    Encrypts conversation state for persistent stores with Fernet (AES with an HMAC),
+    using the key from keyring. Requires the 'cryptography' package.
+    """
+    def __init__(self, key: str | bytes):
+        try:
+            from cryptography.fernet import Fernet, InvalidToken
+        except ImportError as e:
+            raise RuntimeError("The 'cryptography' package is required to persist conversation state (pip install cryptography).") from e
+        self._fernet = Fernet(key)
+        self._invalid_token = InvalidToken
+
+    @staticmethod
+    def generate_key() -> str:
+        from cryptography.fernet import Fernet
+        return Fernet.generate_key().decode()
+
+    def encrypt(self, state: ConversationState) -> str:
+        return self._fernet.encrypt(json.dumps(state.to_dict()).encode()).decode()
+
+    def decrypt(self, raw: str | bytes) -> ConversationState | None:
+        """Returns the stored state, or None if it cannot be decrypted (e.g. written with another key)."""
+        try:
+            return ConversationState.from_dict(json.loads(self._fernet.decrypt(raw)))
+        except (self._invalid_token, ValueError):
+            logger.warning("Discarding conversation state that could not be decrypted.")
+            return None
+
+
+class StateStore(ABC):
+    """
+    Interface for conversation state storage.
+    States are ConversationState records keyed by Telegram user id.
+    """
+    # True if other bot processes may write to the same store
+    shared = True
+
+    def __init__(self, ttl: float = DEFAULT_STATE_TTL):
+        self.ttl = ttl
+
+    @abstractmethod
+    async def get(self, user_id: int) -> ConversationState | None:
+        """Returns the stored state for a user, or None if missing or expired."""
+
+    @abstractmethod
+    async def set(self, user_id: int, state: ConversationState):
+        """Stores the state for a user and resets its expiry."""
+
+    @abstractmethod
+    async def delete(self, user_id: int):
+        """Removes the state for a user."""
+
+    async def active_user_ids(self) -> list[int]:
+        """Returns the ids of all users with an unexpired state."""
+        return []
+
+    async def close(self):
+        """Flushes pending writes and releases resources."""
+
+
+class MemoryStateStore(StateStore):
+    """
+    In-process store, split into shards by user id so TTL purges only touch
+    one small shard per call. Fast, but state is lost on restart and cannot
+    be shared between bot processes.
+    """
+    shared = False
+
+    def __init__(self, ttl: float = DEFAULT_STATE_TTL, shards: int = 16):
+        super().__init__(ttl)
+        # Each shard is ordered by last write, so its expired entries are always at the front
+        self._shards: list[OrderedDict[int, tuple[float, ConversationState]]] = [OrderedDict() for _ in range(shards)]
+        self._in_progress = 0 # Stored states past the initial step, kept up to date on every change
+
+    def _shard(self, user_id: int) -> OrderedDict:
+        return self._shards[user_id % len(self._shards)]
+
+    def _forget(self, state: ConversationState):
+        if state.step != Step.INITIAL:
+            self._in_progress -= 1
+
+    def _purge_expired(self, shard: OrderedDict, now: float):
+        while shard:
+            user_id, (expires_at, state) = next(iter(shard.items()))
+            if expires_at > now:
+                break
+            del shard[user_id]
+            self._forget(state)
+
+    async def get(self, user_id: int) -> ConversationState | None:
+        shard = self._shard(user_id)
+        self._purge_expired(shard, time.monotonic())
+        entry = shard.get(user_id)
+        return entry[1] if entry else None
+
+    def peek(self, user_id: int) -> ConversationState | None:
+        """Synchronous lookup for callers that cannot await, such as event filters."""
+        entry = self._shard(user_id).get(user_id)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    @property
+    def in_progress_count(self) -> int:
+        """Number of unexpired states past the initial step."""
+        now = time.monotonic()
+        for shard in self._shards:
+            self._purge_expired(shard, now) # Only touches the expired entries at the front
+        return self._in_progress
+
+    async def set(self, user_id: int, state: ConversationState):
+        shard = self._shard(user_id)
+        now = time.monotonic()
+        previous = shard.get(user_id)
+        if previous is not None:
+            self._forget(previous[1])
+        if state.step != Step.INITIAL:
+            self._in_progress += 1
+        shard[user_id] = (now + self.ttl, state)
+        shard.move_to_end(user_id)
+        self._purge_expired(shard, now)
+
+    async def delete(self, user_id: int):
+        entry = self._shard(user_id).pop(user_id, None)
+        if entry is not None:
+            self._forget(entry[1])
+
+    async def active_user_ids(self) -> list[int]:
+        return [user_id for shard in self._shards for user_id in shard]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+
+class SQLiteStateStore(StateStore):
+    """
+    SQLite-backed store in WAL mode, so several bot processes on one host can share it.
+    Writes are buffered and committed in batches on a dedicated database thread.
+    """
+    _DELETED = object()
+
+    def __init__(self, path: str, cipher: StateCipher, ttl: float = DEFAULT_STATE_TTL,
+                 flush_interval: float = 0.5, batch_size: int = 100):
+        super().__init__(ttl)
+        self.path = path
+        self.cipher = cipher
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # sqlite3 connections must be used from the thread that created them
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state-sqlite')
+        self._conn: sqlite3.Connection | None = None
+        self._pending: dict[int, object] = {}
+        self._writing: dict[int, object] = {} # Batch currently being committed
+        self._flush_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_state ("
+            "user_id INTEGER PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS conversation_state_expiry ON conversation_state (expires_at)")
+        conn.commit()
+        self._conn = conn
+
+    async def _ensure_connected(self):
+        if self._conn is None:
+            await self._run(self._connect)
+
+    def _read(self, user_id: int, now: float) -> str | None:
+        row = self._conn.execute( # type: ignore
+            "SELECT state FROM conversation_state WHERE user_id = ? AND expires_at > ?", (user_id, now)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _read_user_ids(self, now: float) -> list[int]:
+        rows = self._conn.execute( # type: ignore
+            "SELECT user_id FROM conversation_state WHERE expires_at > ?", (now,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _write_batch(self, batch: dict[int, object], now: float):
+        conn = self._conn
+        with conn: # type: ignore
+            for user_id, state in batch.items():
+                if state is self._DELETED:
+                    conn.execute("DELETE FROM conversation_state WHERE user_id = ?", (user_id,)) # type: ignore
+                else:
+                    conn.execute( # type: ignore
+                        "INSERT OR REPLACE INTO conversation_state (user_id, state, expires_at) VALUES (?, ?, ?)",
+                        (user_id, self.cipher.encrypt(state), now + self.ttl) # type: ignore
+                    )
+            # Evict abandoned conversations as part of the same transaction
+            conn.execute("DELETE FROM conversation_state WHERE expires_at <= ?", (now,)) # type: ignore
+
+    async def get(self, user_id: int) -> ConversationState | None:
+        for buffered in (self._pending, self._writing):
+            if user_id in buffered:
+                state = buffered[user_id]
+                return None if state is self._DELETED else state # type: ignore
+        await self._ensure_connected()
+        raw = await self._run(self._read, user_id, time.time())
+        return self.cipher.decrypt(raw) if raw else None
+
+    async def active_user_ids(self) -> list[int]:
+        await self.flush()
+        await self._ensure_connected()
+        return await self._run(self._read_user_ids, time.time())
+
+    async def set(self, user_id: int, state: ConversationState):
+        self._pending[user_id] = state
+        self._schedule_flush()
+
+    async def delete(self, user_id: int):
+        self._pending[user_id] = self._DELETED
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if len(self._pending) >= self.batch_size:
+            asyncio.ensure_future(self.flush())
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Commits all buffered writes in a single transaction."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._writing = batch
+            try:
+                await self._ensure_connected()
+                await self._run(self._write_batch, batch, time.time())
+            except sqlite3.Error as e:
+                logger.error("Failed to write conversation state batch to SQLite: %s", e)
+                # Put the batch back unless newer writes for the same users arrived meanwhile
+                for user_id, state in batch.items():
+                    self._pending.setdefault(user_id, state)
+            finally:
+                self._writing = {}
+
+    async def close(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+        await self.flush()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+
+class RedisStateStore(StateStore):
+    """
+    Store backed by any client speaking the redis.asyncio API (redis-py, fakeredis).
+    Expiry is delegated to Redis key TTLs.
+    """
+    def __init__(self, redis_client, cipher: StateCipher, ttl: float = DEFAULT_STATE_TTL,
+                 key_prefix: str = 'experianbot:state:'):
+        super().__init__(ttl)
+        self.redis = redis_client
+        self.cipher = cipher
+        self.key_prefix = key_prefix
+
+    @classmethod
+    def from_url(cls, url: str, cipher: StateCipher, **kwargs) -> 'RedisStateStore':
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("The 'redis' package is required for the Redis state backend (pip install redis).") from e
+        return cls(redis_asyncio.from_url(url), cipher, **kwargs)
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.key_prefix}{user_id}"
+
+    async def get(self, user_id: int) -> ConversationState | None:
+        raw = await self.redis.get(self._key(user_id))
+        return self.cipher.decrypt(raw) if raw else None
+
+    async def set(self, user_id: int, state: ConversationState):
+        await self.redis.set(self._key(user_id), self.cipher.encrypt(state), ex=max(int(self.ttl), 1))
+
+    async def delete(self, user_id: int):
+        await self.redis.delete(self._key(user_id))
+
+    async def active_user_ids(self) -> list[int]:
+        prefix_length = len(self.key_prefix)
+        user_ids = []
+        async for key in self.redis.scan_iter(match=f"{self.key_prefix}*"):
+            if isinstance(key, bytes):
+                key = key.decode()
+            user_ids.append(int(key[prefix_length:]))
+        return user_ids
+
+    async def close(self):
+        close = getattr(self.redis, 'aclose', None) or getattr(self.redis, 'close', None)
+        if close:
+            await close()
+
+
+def create_state_store(backend: str, ttl: float = DEFAULT_STATE_TTL,
+                       sqlite_path: str = 'bot_state.sqlite3', redis_url: str = 'redis://localhost:6379/0',
+                       encryption_key: str | None = None) -> StateStore:
+    """
+    Creates the state store selected by name ('memory', 'sqlite' or 'redis').
+    The persistent backends need `encryption_key`, since the state holds customer data.
+    """
+    backend = backend.lower()
+    if backend == 'memory':
+        return MemoryStateStore(ttl)
+    if backend in ('sqlite', 'redis') and not encryption_key:
+        raise ValueError(f"The '{backend}' state backend requires a state encryption key in keyring (see set_secrets.py).")
+    if backend == 'sqlite':
+        return SQLiteStateStore(sqlite_path, StateCipher(encryption_key), ttl) # type: ignore
+    if backend == 'redis':
+        return RedisStateStore.from_url(redis_url, StateCipher(encryption_key), ttl=ttl) # type: ignore
+    raise ValueError(f"Unknown state backend '{backend}'. Expected 'memory', 'sqlite' or 'redis'.")
@@ -1,164 +1,244 @@
 import logging
-from telethon import events, Button
+import re
+from contextlib import ExitStack
+from telethon import events
+from conversation_flow import FLOW, FIRST_STEP
+from conversation_state import Step, INITIAL_STATE
+from credit_report import CreditReport
 from state_manager import StateManager
-from experian_api import call_experian_credit_risk_api
+from dispatcher import ExperianDispatcher
+from lifecycle import Lifecycle
+from metrics import timed_handler
+from result_cache import ResultCache
+from sender import TelegramSender
 
 logger = logging.getLogger(__name__)
 
+# Commands may be addressed to the bot explicitly, e.g. /start@ExperianBot
+START_COMMAND = re.compile(r'^/start(?:@\w+)?(?:\s|$)')
+CHECK_CREDIT_COMMAND = re.compile(r'^/check_credit(?:@\w+)?(?:\s|$)')
+
+RESTARTING_MESSAGE = "The bot is restarting. Your earlier answers have been saved; please send your last answer again in a minute."
+
 class TelegramBot:
     """
     Handles Telegram bot interactions and manages conversation flow.
     """
-    def __init__(self, client, state_manager: StateManager):
+    def __init__(self, client, state_manager: StateManager, dispatcher: ExperianDispatcher | None = None,
+                 result_cache: ResultCache | None = None, lifecycle: Lifecycle | None = None,
+                 sender: TelegramSender | None = None):
         self.client = client
         self.state_manager = state_manager
+        self.dispatcher = dispatcher or ExperianDispatcher()
+        self.result_cache = result_cache or ResultCache()
+        self.lifecycle = lifecycle or Lifecycle()
+        self.sender = sender or TelegramSender()
         self._register_handlers()
 
     def _register_handlers(self):
-        """Registers all event handlers for the Telegram bot."""
-        self.client.add_event_handler(self.start_handler, events.NewMessage(pattern='/start'))
-        self.client.add_event_handler(self.check_credit_start, events.NewMessage(pattern='/check_credit'))
-        self.client.add_event_handler(self.handle_user_input, events.NewMessage)
-        self.client.add_event_handler(self.handle_callback_query, events.CallbackQuery)
-
+        """
+        Registers all event handlers for the Telegram bot.
+        The conversation collects personal data, so only private chats are handled,
+        and flow input only reaches handle_user_input for users with a conversation in progress.
+        """
+        self.client.add_event_handler(self.start_handler,
+                                      events.NewMessage(incoming=True, pattern=START_COMMAND, func=self._is_private))
+        self.client.add_event_handler(self.check_credit_start,
+                                      events.NewMessage(incoming=True, pattern=CHECK_CREDIT_COMMAND, func=self._is_private))
+        self.client.add_event_handler(self.handle_user_input,
+                                      events.NewMessage(incoming=True, func=self._is_flow_input))
+        self.client.add_event_handler(self.handle_callback_query, events.CallbackQuery(func=self._is_private))
+
+    @staticmethod
+    def _is_private(event) -> bool:
+        return event.is_private
+
+    def _is_flow_input(self, event):
+        """
+        Event filter for conversation input: non-command text in a private chat from a user
+        with a conversation in progress. Uses the StateManager's in-memory active-user set;
+        with a shared store, a miss falls back to the store since another process may own the flow.
+        """
+        if not event.is_private or not event.text or event.text.startswith('/'):
+            return False
+        if self.state_manager.is_active(event.sender_id):
+            return True
+        if self.state_manager.store.shared:
+            return self.state_manager.has_active_flow(event.sender_id)
+        return False
+
+    async def _respond(self, event, message, buttons=None):
+        """Queues a message to the event's chat. Returns without waiting for it to be sent."""
+        return self.sender.send(event, message, buttons=buttons)
+
+    async def _edit(self, event, message, buttons=None):
+        """Queues an edit of the message the event came from (e.g. the one with the clicked button)."""
+        return self.sender.edit(event, message, buttons=buttons)
+
+    @timed_handler
     async def start_handler(self, event):
         """Handles the /start command."""
         user_id = event.sender_id
-        self.state_manager.set_state(user_id, 'initial')
-        await event.respond(
+        await self.state_manager.set_state(user_id, Step.INITIAL)
+        await self._respond(event,
             "Hello! I can help you check credit risk data via Experian. "
             "**Please be aware:** This process involves collecting sensitive personal information "
             "which will be sent to Experian for analysis. By proceeding, you consent to this. "
             "\n\nTo begin, type /check_credit."
         )
-        logger.info(f"User {user_id} started the bot.")
+        logger.info("User %s started the bot.", user_id)
 
+    def _hold_final_step(self) -> bool:
+        """
+        While shutting down, a shared store keeps the conversation at its last step so
+        it can be finished after the restart. A process-local store would lose it, so
+        the check is run instead and the shutdown drain waits for it.
+        """
+        return not self.lifecycle.accepting and self.state_manager.store.shared
+
+    @timed_handler
     async def check_credit_start(self, event):
         """Initiates the credit check process."""
         user_id = event.sender_id
-        self.state_manager.set_state(user_id, 'ask_first_name')
-        await event.respond("Okay, let's start the credit check. What is your **first name**?")
-        logger.info(f"User {user_id} initiated credit check.")
+        if not self.lifecycle.accepting:
+            await self._respond(event, "The bot is restarting. Please send /check_credit again in a minute.")
+            return
+        await self.state_manager.clear_state(user_id) # Start over, discarding any earlier answers
+        await self.state_manager.set_state(user_id, FIRST_STEP)
+        await self._respond(event, FLOW[FIRST_STEP].prompt)
+        logger.info("User %s initiated credit check.", user_id)
 
+    @timed_handler
     async def handle_user_input(self, event):
         """Handles subsequent user input based on the current conversation state."""
         user_id = event.sender_id
-        current_state = self.state_manager.get_state(user_id)
-
-        if not current_state or event.text.startswith('/'): # Ignore commands if not in a specific flow
+        if not event.text or event.text.startswith('/'): # Ignore commands if not in a specific flow
             return
-
-        step = current_state['step']
         user_input = event.text
 
-        if step == 'ask_first_name':
-            self.state_manager.update_data(user_id, 'first_name', user_input)
-            self.state_manager.set_state(user_id, 'ask_last_name')
-            await event.respond("Thanks! What is your **last name**?")
-        elif step == 'ask_last_name':
-            self.state_manager.update_data(user_id, 'last_name', user_input)
-            self.state_manager.set_state(user_id, 'ask_address')
-            await event.respond("Please provide your **street address** (e.g., 123 Main St).")
-        elif step == 'ask_address':
-            self.state_manager.update_data(user_id, 'address', user_input)
-            self.state_manager.set_state(user_id, 'ask_city')
-            await event.respond("What is your **city**?")
-        elif step == 'ask_city':
-            self.state_manager.update_data(user_id, 'city', user_input)
-            self.state_manager.set_state(user_id, 'ask_state')
-            await event.respond("What is your **state/province** (e.g., CA, NY)?")
-        elif step == 'ask_state':
-            self.state_manager.update_data(user_id, 'state', user_input)
-            self.state_manager.set_state(user_id, 'ask_zip_code')
-            await event.respond("What is your **zip/postal code**?")
-        elif step == 'ask_zip_code':
-            self.state_manager.update_data(user_id, 'zip_code', user_input)
-            self.state_manager.set_state(user_id, 'ask_dob')
-            await event.respond("What is your **date of birth** (YYYY-MM-DD)?")
-        elif step == 'ask_dob':
-            self.state_manager.update_data(user_id, 'dob', user_input)
-            self.state_manager.set_state(user_id, 'ask_ssn_consent')
-            # Crucial: Ask for SSN consent and explain its sensitivity
-            await event.respond(
-                "To get the most accurate credit risk data, we typically need your **Social Security Number (SSN)**. "
-                "**WARNING:** Providing your SSN is highly sensitive. It will be transmitted securely to Experian. "
-                "We do not store your SSN. "
-                "Do you consent to provide your SSN? (Yes/No)",
-                buttons=[
-                    [Button.inline("Yes, provide SSN", b'consent_ssn_yes')],
-                    [Button.inline("No, skip SSN", b'consent_ssn_no')]
-                ]
-            )
-        elif step == 'ask_ssn':
-            self.state_manager.update_data(user_id, 'ssn', user_input)
-            await self._process_experian_request(event, user_id)
-        else:
-            # Fallback for unhandled states or if user types something unexpected
-            await event.respond("I'm not sure what you mean. Please use /start or /check_credit to begin.")
-            self.state_manager.clear_state(user_id) # Clear state
-            logger.warning(f"User {user_id} entered unexpected input in step {step}: {user_input}")
-
+        final_data = None
+        with ExitStack() as in_flight:
+            # One store read and at most one write per message
+            async with self.state_manager.edit(user_id) as edit:
+                current_state = edit.state or INITIAL_STATE
+                step = current_state.step
+                flow_step = FLOW.get(step)
+
+                if flow_step is None:
+                    # Fallback for unhandled states or if user types something unexpected
+                    await self._respond(event, "I'm not sure what you mean. Please use /start or /check_credit to begin.")
+                    if edit.state is not None:
+                        await edit.delete() # Clear state
+                    logger.warning("User %s entered unexpected input in step %s.", user_id, step.value)
+                    return
+
+                if flow_step.choices:
+                    # This step is answered with the inline buttons, not with text
+                    await self._respond(event, "Please choose one of the options above.")
+                    return
+
+                if flow_step.validator:
+                    error = flow_step.validator(user_input)
+                    if error:
+                        await self._respond(event, error)
+                        return
+
+                value = user_input.strip()
+                if flow_step.next_step is None:
+                    if self._hold_final_step():
+                        await self._respond(event, RESTARTING_MESSAGE)
+                        return
+                    # Last step: hand the data to Experian without storing the final answer.
+                    # The check counts as in flight from the moment the flow completes.
+                    in_flight.enter_context(self.lifecycle.track())
+                    await edit.delete()
+                    final_data = current_state.with_data(**{flow_step.field: value}).data
+                else:
+                    await edit.save(current_state.with_step(flow_step.next_step).with_data(**{flow_step.field: value}))
+                    next_step = FLOW[flow_step.next_step]
+                    await self._respond(event, next_step.prompt, buttons=next_step.buttons)
+
+            if final_data is not None:
+                await self._process_experian_request(event, user_id, final_data)
+
+    @timed_handler
     async def handle_callback_query(self, event):
-        """Handles button clicks for consent."""
+        """Handles inline button clicks for steps answered with choices."""
         user_id = event.sender_id
-        current_state = self.state_manager.get_state(user_id)
-
-        if not current_state or current_state['step'] != 'ask_ssn_consent':
-            await event.answer("This action is no longer valid or you are not in the correct step.", alert=True)
-            logger.warning(f"User {user_id} clicked invalid button in step {current_state.get('step') if current_state else 'N/A'}.")
-            return
-
-        data = event.data.decode('utf-8')
-
-        if data == 'consent_ssn_yes':
-            self.state_manager.set_state(user_id, 'ask_ssn')
-            await event.edit("Please enter your **Social Security Number (SSN)**. (e.g., XXX-XX-XXXX).")
-            logger.info(f"User {user_id} consented to provide SSN.")
-        elif data == 'consent_ssn_no':
-            self.state_manager.update_data(user_id, 'ssn', None) # Explicitly set to None
-            await event.edit("You chose not to provide your SSN. Proceeding without it.")
-            logger.info(f"User {user_id} skipped providing SSN.")
-            await self._process_experian_request(event, user_id)
-
-        await event.answer() # Dismiss the loading indicator on the button
-
-    async def _process_experian_request(self, event, user_id):
+        final_data = None
+        with ExitStack() as in_flight:
+            async with self.state_manager.edit(user_id) as edit:
+                current_state = edit.state
+                flow_step = FLOW.get(current_state.step) if current_state else None
+                choice = flow_step.choices.get(event.data) if flow_step else None
+                if choice is not None:
+                    step = current_state.step # type: ignore
+                    data = {flow_step.field: choice.value} if flow_step.field else {} # type: ignore
+                    if choice.next_step is None:
+                        if not self._hold_final_step():
+                            in_flight.enter_context(self.lifecycle.track())
+                            await edit.delete()
+                            final_data = current_state.with_data(**data).data # type: ignore
+                    else:
+                        state = current_state.with_step(choice.next_step) # type: ignore
+                        await edit.save(state.with_data(**data) if data else state)
+
+            if choice is None:
+                await event.answer("This action is no longer valid or you are not in the correct step.", alert=True)
+                logger.warning("User %s clicked invalid button in step %s.", user_id, current_state.step.value if current_state else 'N/A')
+                return
+
+            if choice.next_step is None:
+                if final_data is None:
+                    await event.answer(RESTARTING_MESSAGE, alert=True)
+                    return
+                await self._edit(event, choice.reply)
+                await event.answer() # Dismiss the loading indicator on the button
+                logger.info("User %s chose '%s' in step %s.", user_id, choice.label, step.value)
+                await self._process_experian_request(event, user_id, final_data)
+                return
+
+            next_step = FLOW[choice.next_step]
+            await self._edit(event, choice.reply or next_step.prompt, buttons=next_step.buttons)
+            logger.info("User %s chose '%s' in step %s.", user_id, choice.label, step.value)
+            await event.answer() # Dismiss the loading indicator on the button
+
+    async def _process_experian_request(self, event, user_id, customer_data: dict):
         """
         Sends the collected data to Experian API and responds to the user.
+        The user's conversation state has already been cleared by the caller.
         """
-        await event.respond("Thank you for the information. I'm now processing your request with Experian. This may take a moment...")
+        await self._respond(event, "Thank you for the information. I'm now processing your request with Experian. This may take a moment...")
 
-        customer_data = self.state_manager.get_state(user_id)['data']
-        logger.info(f"Collected data for Experian API call for user {user_id}: {customer_data}")
+        logger.info("Collected data for Experian API call for user %s.", user_id)
 
-        experian_response = await call_experian_credit_risk_api(customer_data)
+        async def report_position(position: int):
+            await self._respond(event, f"You are number **{position}** in the queue. Your request will be processed shortly.")
 
-        if experian_response and not experian_response.get('error'):
-            # --- Process Experian Response ---
-            # This part is highly dependent on the actual Experian API response structure.
-            # You'll need to parse the JSON and extract relevant information.
-            # For demonstration, we'll just show a simplified mock response.
+        experian_response = await self.result_cache.fetch(
+            customer_data,
+            lambda on_position: self.dispatcher.submit(customer_data, on_position=on_position, user_id=user_id),
+            on_position=report_position)
 
-            mock_credit_score = experian_response.get('creditScore', 'N/A')
-            mock_risk_level = experian_response.get('riskLevel', 'Unknown')
-            mock_summary = experian_response.get('summary', 'No detailed summary available.')
+        if isinstance(experian_response, CreditReport):
+            risk_level = experian_response.risk_level or 'Unknown'
+            summary = experian_response.summary or 'No detailed summary available.'
 
             response_message = (
                 "Here is the credit risk data from Experian:\n\n"
-                f"**Credit Score:** {mock_credit_score}\n"
-                f"**Risk Level:** {mock_risk_level}\n"
-                f"**Summary:** {mock_summary}\n\n"
+                f"**Credit Score:** {experian_response.credit_score}\n"
+                f"**Risk Level:** {risk_level}\n"
+                f"**Summary:** {summary}\n\n"
                 "*(This data is for informational purposes only and not financial advice.)*"
             )
-            logger.info(f"Successfully processed Experian response for user {user_id}.")
+            logger.info("Successfully processed Experian response for user %s.", user_id)
         else:
             error_message = experian_response.get('error', 'An unknown error occurred.')
             response_message = (
                 f"I encountered an error while retrieving data from Experian: {error_message}\n"
                 "Please try again later or contact support if the issue persists."
             )
-            logger.error(f"Experian API call failed for user {user_id}: {error_message}")
+            logger.error("Experian API call failed for user %s: %s", user_id, error_message)
 
-        await event.respond(response_message)
-        self.state_manager.clear_state(user_id) # Clear user state after completion
+        await self._respond(event, response_message)
 
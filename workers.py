@@ -0,0 +1,198 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import threading
+from config import Settings, get_settings, set_settings
+from experian_api import call_experian_credit_risk_api, create_http_client, close_http_client, token_manager
+from resilience import ResilientCaller
+
+logger = logging.getLogger(__name__)
+
+# --- Worker Processes ---
+# In worker mode the bot process only talks to Telegram. Completed credit checks
+# are sent to a pool of worker processes, each with its own event loop, HTTP
+# client and Experian token, and the results are sent back over a result queue.
+# Workers get the bot's settings snapshot when they start, so only the bot
+# process reads keyring.
+
+_CONTEXT = multiprocessing.get_context('spawn')
+
+def _worker_main(index: int, settings: Settings, jobs, results):
+    """Entry point of a worker process."""
+    set_settings(settings)
+    try:
+        asyncio.run(_worker_loop(index, jobs, results))
+    except KeyboardInterrupt:
+        pass
+
+async def _worker_loop(index: int, jobs, results):
+    create_http_client()
+    call = ResilientCaller(call_experian_credit_risk_api)
+    loop = asyncio.get_running_loop()
+    # Last job per user, so each user's checks run in the order they were submitted
+    last_job_by_user: dict[int, asyncio.Task] = {}
+    running: set[asyncio.Task] = set()
+    # Fetch the token in the background so the first job does not have to wait for it
+    warm_up = asyncio.create_task(token_manager.get_token())
+    logger.info("Experian worker %d started.", index)
+
+    async def run_job(job_id: int, customer_data: dict, previous: asyncio.Task | None):
+        if previous is not None:
+            await asyncio.wait({previous})
+        try:
+            result = await call(customer_data)
+        except Exception as e:
+            logger.error("Experian worker %d failed to process a job: %s", index, e)
+            result = {"error": f"An unexpected error occurred: {e}"}
+        results.put((job_id, result))
+
+    while True:
+        job = await loop.run_in_executor(None, jobs.get)
+        if job is None: # Shutdown sentinel: finish what was already received, then exit
+            break
+        job_id, user_id, customer_data = job
+        task = asyncio.create_task(run_job(job_id, customer_data, last_job_by_user.get(user_id)))
+        last_job_by_user[user_id] = task
+        running.add(task)
+
+        def finished(done: asyncio.Task, user_id=user_id):
+            running.discard(done)
+            if last_job_by_user.get(user_id) is done:
+                del last_job_by_user[user_id]
+        task.add_done_callback(finished)
+
+    if running:
+        await asyncio.wait(running)
+    warm_up.cancel()
+    await token_manager.close()
+    await close_http_client()
+    logger.info("Experian worker %d stopped.", index)
+
+
+class _Worker:
+    def __init__(self, index: int, results):
+        self.index = index
+        self.jobs = _CONTEXT.Queue()
+        self.process = _CONTEXT.Process(target=_worker_main, args=(index, get_settings(), self.jobs, results),
+                                        name=f'experian-worker-{index}', daemon=True)
+        self.process.start()
+
+
+class WorkerPool:
+    """
+    Runs Experian credit checks in separate processes. Jobs are routed by user id,
+    so all checks for one user go to the same worker and keep their order.
+    Use `call` as the ExperianDispatcher's call function.
+    """
+    def __init__(self, processes: int, monitor_interval: float = 1.0):
+        self.processes = processes
+        self.monitor_interval = monitor_interval
+        self._results = _CONTEXT.Queue()
+        self._workers: list[_Worker] = []
+        # Job id -> (worker it was sent to, user id, future). Keyed by worker rather than slot,
+        # since a slot briefly has two workers while restart_workers replaces them
+        self._pending: dict[int, tuple[_Worker, int | None, asyncio.Future]] = {}
+        self._job_ids = itertools.count(1)
+        self._round_robin = itertools.count()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._reader: threading.Thread | None = None
+        self._monitor: asyncio.Task | None = None
+        self._stopping = False
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._workers = [_Worker(i, self._results) for i in range(self.processes)]
+        self._reader = threading.Thread(target=self._read_results, name='experian-results', daemon=True)
+        self._reader.start()
+        self._monitor = asyncio.create_task(self._monitor_workers())
+        logger.info("Started %d Experian worker processes.", self.processes)
+
+    async def call(self, customer_data: dict, user_id: int | None = None) -> dict:
+        """Sends a credit check to the worker owning `user_id` and waits for its result."""
+        index = (user_id if user_id is not None else next(self._round_robin)) % len(self._workers)
+        worker = self._workers[index]
+        job_id = next(self._job_ids)
+        future = self._loop.create_future() # type: ignore
+        # After a restart, the slot's old worker may still be running this user's earlier checks
+        earlier = [f for w, u, f in self._pending.values() if u == user_id and w is not worker] if user_id is not None else []
+        self._pending[job_id] = (worker, user_id, future)
+        try:
+            if earlier:
+                await asyncio.wait(earlier)
+                if future.done(): # The new worker died meanwhile
+                    return future.result()
+            worker.jobs.put((job_id, user_id, customer_data))
+            return await future
+        finally:
+            self._pending.pop(job_id, None)
+
+    def _read_results(self):
+        """Runs in a thread: hands results from the worker processes to the event loop."""
+        while True:
+            try:
+                item = self._results.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            self._loop.call_soon_threadsafe(self._resolve, *item) # type: ignore
+
+    def _resolve(self, job_id: int, result: dict):
+        entry = self._pending.get(job_id)
+        if entry and not entry[2].done():
+            entry[2].set_result(result)
+
+    def _fail_jobs(self, worker: _Worker, message: str):
+        for job_worker, _, future in list(self._pending.values()):
+            if job_worker is worker and not future.done():
+                future.set_result({"error": message})
+
+    async def _monitor_workers(self):
+        """Replaces worker processes that died, failing the jobs they were handling."""
+        while not self._stopping:
+            await asyncio.sleep(self.monitor_interval)
+            for index, worker in enumerate(self._workers):
+                if worker.process.is_alive() or self._stopping:
+                    continue
+                logger.error("Experian worker %d exited unexpectedly (exit code %s); restarting it.",
+                             index, worker.process.exitcode)
+                # The job may or may not have reached Experian, so it is not resent automatically
+                self._fail_jobs(worker, "The credit check was interrupted. Please try again.")
+                self._workers[index] = _Worker(index, self._results)
+
+    async def restart_workers(self):
+        """
+        Replaces the workers one at a time without interrupting the bot. Each old worker
+        finishes the jobs it already received; new jobs go to its replacement, which
+        starts with the current settings snapshot. A user's new jobs wait until the old
+        worker has finished their earlier ones, so their checks keep their order.
+        """
+        for index, old in enumerate(list(self._workers)):
+            self._workers[index] = _Worker(index, self._results)
+            old.jobs.put(None)
+            await asyncio.to_thread(old.process.join)
+            if old.process.exitcode:
+                logger.error("Experian worker %d exited with code %s while being restarted.", index, old.process.exitcode)
+                self._fail_jobs(old, "The credit check was interrupted. Please try again.")
+            logger.info("Restarted Experian worker %d.", index)
+
+    async def stop(self, timeout: float = 30):
+        """Lets the workers finish their jobs (up to `timeout` seconds), then stops them."""
+        self._stopping = True
+        if self._monitor:
+            self._monitor.cancel()
+        for worker in self._workers:
+            worker.jobs.put(None)
+        for worker in self._workers:
+            await asyncio.to_thread(worker.process.join, timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            self._fail_jobs(worker, "The service is shutting down. Please try again shortly.")
+        try:
+            self._results.put(None)
+        except (ValueError, OSError):
+            pass
+        if self._reader:
+            await asyncio.to_thread(self._reader.join, 5)
+        logger.info("Stopped Experian worker processes.")